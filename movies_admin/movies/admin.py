@@ -1,31 +1,108 @@
+import re
+import uuid
+
 from django.contrib import admin
-from .models import Genre, Filmwork, Person, GenreFilmwork, PersonFilmwork
+from django.contrib.admin.views.main import SEARCH_VAR
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            TrigramSimilarity)
+from django.db.models import DecimalField, Q
+from django.db.models.functions import Cast
+from .models import (Genre, Filmwork, Person, GenreFilmwork, PersonFilmwork,
+                     SEARCH_CONFIG, filmwork_search_vector)
+from .pagination import KeysetPaginationMixin
 
 
+# autocomplete widgets render only the selected option and look other
+# ones up page by page, through search_fields of the related admin
 class GenreFilmworkInline(admin.TabularInline):
     model = GenreFilmwork
+    autocomplete_fields = ('genre',)
 
 
 class PersonFilmworkInline(admin.TabularInline):
     model = PersonFilmwork
+    autocomplete_fields = ('person',)
 
 
 @admin.register(Genre)
 class GenreAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('name', )
+
+    search_fields = ('name', )
+
+    # autocomplete pages need a stable order
+    ordering = ('name', )
 
 
 @admin.register(Filmwork)
-class FilmWork(admin.ModelAdmin):
+class FilmWork(KeysetPaginationMixin, admin.ModelAdmin):
     inlines = (GenreFilmworkInline, PersonFilmworkInline)
 
     list_display = ('title', 'type', 'creation_date', 'rating', )
 
     list_filter = ('type', 'creation_date',)
 
-    search_fields = ('title', 'description', 'id')
+    # shows the search box, the lookup itself is get_search_results()
+    search_fields = ('title', 'description')
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+            a film work id      -> primary key lookup
+            anything else       -> full-text match on title and
+                                   description (film_work_search_idx),
+                                   best ranked first unless the list
+                                   is sorted by a column
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        try:
+            return queryset.filter(pk=uuid.UUID(search_term)), False
+        except ValueError:
+            pass
+        query = SearchQuery(search_term, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        # the float4 rank is rounded to numeric, so the cursor of the
+        # next page holds the exact value the list is ordered by
+        queryset = queryset.annotate(
+            search=filmwork_search_vector(),
+            rank=Cast(SearchRank(filmwork_search_vector(weighted=True),
+                                 query),
+                      DecimalField(max_digits=12, decimal_places=6)),
+        ).filter(search=query).order_by('-rank')
+        return queryset, False
 
 
 @admin.register(Person)
-class Person(admin.ModelAdmin):
-    pass
+class Person(KeysetPaginationMixin, admin.ModelAdmin):
+    list_display = ('full_name', )
+
+    search_fields = ('full_name', )
+
+    def get_ordering(self, request):
+        # search results come best matching first: no `ordering`
+        # attribute, ChangeList would put it before the similarity
+        if request.GET.get(SEARCH_VAR):
+            return ()
+        # unique, so pages can follow it by key (person_full_name_id_idx)
+        return ('full_name', 'id')
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+            names containing the term (any case) or similar to it
+            (typos), both served by person_full_name_trgm_idx,
+            ordered by trigram similarity; also used by the
+            autocomplete of Filmwork inlines
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        # ~* and % are gin_trgm_ops operators, UPPER() LIKE of
+        # icontains is not
+        queryset = queryset.annotate(
+            similarity=TrigramSimilarity('full_name', search_term),
+        ).filter(
+            Q(full_name__iregex=re.escape(search_term))
+            | Q(full_name__trigram_similar=search_term)
+        ).order_by('-similarity', 'full_name')
+        return queryset, False
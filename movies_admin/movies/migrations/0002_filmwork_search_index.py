@@ -0,0 +1,20 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # film_work stays writable while the index is built
+    atomic = False
+
+    dependencies = [
+        ('movies', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='filmwork',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('title', 'description', config='english'), name='film_work_search_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import (AddIndexConcurrently,
+                                                TrigramExtension)
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # person stays writable while the index is built
+    atomic = False
+
+    dependencies = [
+        ('movies', '0002_filmwork_search_index'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='person',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['full_name'], name='person_full_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
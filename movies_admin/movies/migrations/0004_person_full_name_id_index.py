@@ -0,0 +1,18 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # person stays writable while the index is built
+    atomic = False
+
+    dependencies = [
+        ('movies', '0003_person_full_name_trgm_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='person',
+            index=models.Index(fields=['full_name', 'id'], name='person_full_name_id_idx'),
+        ),
+    ]
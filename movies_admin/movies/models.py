@@ -1,9 +1,27 @@
 import uuid
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.translation import gettext_lazy as _
 
 
+# text search configuration of film works, queries must use the same
+# one for the search index to be used
+SEARCH_CONFIG = 'english'
+
+
+def filmwork_search_vector(weighted=False):
+    """tsvector of title and description, the expression of the
+    film_work_search_idx index; weighted=True ranks title over
+    description (for ordering only, it does not match the index)"""
+    if weighted:
+        return (SearchVector('title', weight='A', config=SEARCH_CONFIG)
+                + SearchVector('description', weight='B',
+                               config=SEARCH_CONFIG))
+    return SearchVector('title', 'description', config=SEARCH_CONFIG)
+
+
 class ElemType(models.TextChoices):
     movie = 'movie', _('Movie')
     tv_show = 'tv show', _('TV Show')
@@ -31,6 +49,14 @@ class Person(UUIDMixin, TimeStampedMixin):
         db_table = "content\".\"person"
         verbose_name = _('Person')
         verbose_name_plural = _('Persons')
+        indexes = [
+            # substring and similarity search by name (pg_trgm)
+            GinIndex(fields=['full_name'], opclasses=['gin_trgm_ops'],
+                     name='person_full_name_trgm_idx'),
+            # the admin list ordering
+            models.Index(fields=['full_name', 'id'],
+                         name='person_full_name_id_idx'),
+        ]
 
     def __str__(self):
         return self.full_name
@@ -69,6 +95,9 @@ class Filmwork(UUIDMixin, TimeStampedMixin):
         db_table = "content\".\"film_work"
         verbose_name = _('Movie')
         verbose_name_plural = _('Movies')
+        indexes = [
+            GinIndex(filmwork_search_vector(), name='film_work_search_idx'),
+        ]
 
     def __str__(self):
         return self.title
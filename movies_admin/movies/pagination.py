@@ -0,0 +1,232 @@
+"""Changelist pagination of large tables
+
+    EstimatedCountPaginator counts the list with the planner's row
+    estimate (pg_class.reltuples of an unfiltered table, EXPLAIN of a
+    filtered list) instead of SELECT COUNT(*), and counts exactly only
+    lists estimated below `exact_count_below` rows.
+
+    KeysetChangeList serves the first `offset_pages` pages with OFFSET
+    and the pages after them by key: the "next" link carries the
+    ordering values of the last row shown (the `cursor` parameter)
+    and the next page is WHERE ROW(ordering) > ROW(cursor) LIMIT per
+    page, read straight from an index on the ordering columns whatever
+    the page depth. Orderings of mixed directions are compared column
+    by column: (a > x) OR (a = x AND b < y). Lists whose ordering can
+    not be followed by key (related fields, expressions, nullable or
+    float columns) are paged with OFFSET all the way.
+"""
+import base64
+import json
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.utils.functional import cached_property
+
+CURSOR_VAR = 'cursor'
+
+
+class EstimatedCountPaginator(Paginator):
+    exact_count_below = 10000
+    # pages listed by get_elided_page_range(), None lists all of them
+    offset_pages = None
+
+    estimated = False
+
+    def estimate(self) -> int:
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                table = connection.ops.quote_name(
+                    queryset.model._meta.db_table)
+                cursor.execute("SELECT reltuples::bigint FROM pg_class "
+                               "WHERE oid = %s::regclass;", (table,))
+                rows = cursor.fetchone()[0]
+                # -1: the table was never vacuumed or analyzed
+                if rows >= 0:
+                    return rows
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
+
+    @cached_property
+    def count(self):
+        rows = self.estimate()
+        if rows < self.exact_count_below:
+            return super().count
+        self.estimated = True
+        return rows
+
+    def get_elided_page_range(self, number=1, **kwargs):
+        if self.offset_pages is None:
+            return super().get_elided_page_range(number, **kwargs)
+        return range(1, min(self.num_pages, self.offset_pages) + 1)
+
+
+def cursor_value(value):
+    if isinstance(value, models.Model):
+        return value.pk
+    if isinstance(value, (int, float, str)):
+        return value
+    # datetimes with microseconds, uuids and decimals as text
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(
+        [cursor_value(value) for value in values]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise IncorrectLookupParameters
+    if not isinstance(values, list):
+        raise IncorrectLookupParameters
+    return values
+
+
+def row(*expressions):
+    """ROW(...) constructor, compared column by column"""
+    return models.Func(*expressions, function='ROW',
+                       output_field=models.Field())
+
+
+class KeysetChangeList(ChangeList):
+    """
+        cursor          : decoded `cursor` parameter or None
+        next_page_url   : link to the page after this one, None when
+                          this page is the last one or the ordering
+                          can not be used as a key
+        first_page_url  : link to the first page (without cursor)
+    """
+    # pages served by OFFSET when the ordering can be used as a key
+    offset_pages = 5
+
+    def get_queryset(self, request):
+        # not a lookup and not kept by filter, search and sort links
+        cursor = self.params.pop(CURSOR_VAR, None)
+        self.cursor = None if cursor is None else decode_cursor(cursor)
+        return super().get_queryset(request)
+
+    def get_ordering(self, request, queryset):
+        self.ordering = super().get_ordering(request, queryset)
+        return self.ordering
+
+    def keyset(self):
+        """[(name, descending), ...] of the ordering when every item
+        is a plain not null field or annotation, else None"""
+        if not all(isinstance(item, str) for item in self.ordering):
+            return None
+        # ChangeList repeats the ordering of ModelAdmin.get_queryset(),
+        # a field sorted by a column link comes twice, the first wins
+        keys = {}
+        for item in self.ordering:
+            keys.setdefault(item.lstrip('-'), item.startswith('-'))
+        keys = list(keys.items())
+        for name, _ in keys:
+            field = self.key_field(name)
+            # NULL matches no comparison; a float from the url does not
+            # compare equal to the stored value (float4 ranks above
+            # all), the row would be shown twice
+            if ('__' in name or field is None or field.null
+                    or isinstance(field, models.FloatField)):
+                return None
+        return keys
+
+    def key_field(self, name: str):
+        """Model field (output field of annotations) preparing cursor
+        values of `name` (text from the url) for the database"""
+        if name == 'pk':
+            return self.lookup_opts.pk
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        try:
+            return self.lookup_opts.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def get_results(self, request):
+        keyset = self.keyset()
+        if self.cursor is not None:
+            if keyset is None or len(self.cursor) != len(keyset):
+                raise IncorrectLookupParameters
+            self.get_keyset_results(request, keyset)
+        elif keyset is not None and self.page_num > self.offset_pages:
+            # deep pages are served by cursor
+            raise IncorrectLookupParameters
+        else:
+            super().get_results(request)
+        self.first_page_url = self.get_query_string()
+        self.next_page_url = None
+        if keyset is not None:
+            self.paginator.offset_pages = self.offset_pages
+            if self.multi_page and not self.show_all:
+                self.next_page_url = self.get_next_page_url(
+                    [name for name, _ in keyset])
+
+    def after_cursor(self, queryset, keys: list):
+        """Rows of `queryset` following the cursor in `keys` order"""
+        descending = {desc for _, desc in keys}
+        if len(descending) == 1:
+            after = 'key__lt' if descending.pop() else 'key__gt'
+            return queryset.alias(
+                key=row(*(models.F(name) for name, _ in keys)),
+            ).filter(**{after: row(*(
+                models.Value(value, output_field=self.key_field(name))
+                for (name, _), value in zip(keys, self.cursor)))})
+        # (a > x) OR (a = x AND b < y) OR ..., the index on `a` is
+        # read from x on
+        after, equal = models.Q(), {}
+        for (name, desc), value in zip(keys, self.cursor):
+            after |= models.Q(**equal,
+                              **{f'{name}__{"lt" if desc else "gt"}': value})
+            equal[name] = value
+        (first, desc), value = keys[0], self.cursor[0]
+        return queryset.filter(
+            after, **{f'{first}__{"lte" if desc else "gte"}': value})
+
+    def get_keyset_results(self, request, keys: list):
+        paginator = self.model_admin.get_paginator(
+            request, self.queryset, self.list_per_page)
+        self.result_list = self.after_cursor(
+            self.queryset, keys)[:self.list_per_page]
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.can_show_all = False
+        self.multi_page = True
+        self.paginator = paginator
+
+    def get_next_page_url(self, names: list):
+        rows = len(self.result_list)
+        if rows < self.list_per_page:
+            return None
+        last = self.result_list[rows - 1]
+        values = [getattr(last, name) for name in names]
+        # ROW comparison with NULL matches nothing, nor is it sorted
+        # after every value
+        if any(value is None for value in values):
+            return None
+        return self.get_query_string({CURSOR_VAR: encode_cursor(values)})
+
+
+class KeysetPaginationMixin:
+    """ModelAdmin mixin: estimated counts and keyset pages"""
+    paginator = EstimatedCountPaginator
+    # the unfiltered total would be one more COUNT(*)
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -1,3 +1,71 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from .models import Filmwork, Genre, GenreFilmwork, Person, PersonFilmwork
+
+
+class MoviesApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        genres = Genre.objects.bulk_create(
+            [Genre(name=f'Genre {i}') for i in range(3)])
+        # two actors of the same name are two persons
+        cls.persons = persons = Person.objects.bulk_create(
+            [Person(full_name=f'Person {i}') for i in range(5)]
+            + [Person(full_name='Person 0')])
+        # type is left out: the migrated column is varchar(2)
+        cls.movies = Filmwork.objects.bulk_create(
+            [Filmwork(title=f'Movie {i}', rating=i) for i in range(12)])
+        GenreFilmwork.objects.bulk_create(
+            [GenreFilmwork(film_work=movie, genre=genre)
+             for movie in cls.movies for genre in genres[:2]])
+        roles = ('actor', 'actor', 'actor', 'writer', 'director',
+                 'actor')
+        PersonFilmwork.objects.bulk_create(
+            [PersonFilmwork(film_work=movie, person=person, role=role)
+             for movie in cls.movies
+             for person, role in zip(persons, roles)])
+
+    def test_list_takes_one_query_per_page(self):
+        expected = sorted(str(movie.id) for movie in self.movies)
+        for page_size in (1, 5, 12, 50):
+            with self.subTest(page_size=page_size):
+                ids, params = [], {'page_size': page_size}
+                while True:
+                    with self.assertNumQueries(1):
+                        response = self.client.get(
+                            reverse('movies-list'), params)
+                    self.assertEqual(response.status_code, 200)
+                    page = response.json()
+                    self.assertLessEqual(len(page['results']), page_size)
+                    ids += [movie['id'] for movie in page['results']]
+                    if page['next'] is None:
+                        break
+                    params['cursor'] = page['next']
+                self.assertEqual(ids, expected)
+
+    def test_detail_splits_persons_by_role(self):
+        movie = self.movies[0]
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse('movies-detail', kwargs={'pk': movie.id}))
+        data = response.json()
+        self.assertEqual(data['title'], movie.title)
+        self.assertCountEqual(
+            [genre['name'] for genre in data['genres']],
+            ['Genre 0', 'Genre 1'])
+        actors = [self.persons[i] for i in (0, 1, 2, 5)]
+        self.assertCountEqual(
+            data['actors'], [{'id': str(person.id),
+                              'full_name': person.full_name}
+                             for person in actors])
+        self.assertEqual([person['full_name'] for person in data['writers']],
+                         ['Person 3'])
+        self.assertEqual([person['full_name']
+                          for person in data['directors']], ['Person 4'])
+
+    def test_bad_cursor(self):
+        response = self.client.get(reverse('movies-list'),
+                                   {'cursor': 'not-an-id'})
+        self.assertEqual(response.status_code, 400)
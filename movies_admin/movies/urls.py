@@ -0,0 +1,9 @@
+from django.urls import path
+
+from movies import views
+
+urlpatterns = [
+    path('v1/movies/', views.MoviesListApi.as_view(), name='movies-list'),
+    path('v1/movies/<uuid:pk>/', views.MoviesDetailApi.as_view(),
+         name='movies-detail'),
+]
@@ -1,3 +1,92 @@
-from django.shortcuts import render
+import uuid
 
-# Create your views here.
+from django.contrib.postgres.aggregates import JSONBAgg
+from django.db.models import F, Q
+from django.db.models.functions import JSONObject
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.views import View
+
+from .models import Filmwork
+
+# PersonFilmwork.role values and the keys they are listed under
+ROLES = (('actor', 'actors'), ('writer', 'writers'),
+         ('director', 'directors'))
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+class MoviesApiMixin:
+    """
+        Film works with their genres and persons by role, one SQL
+        query for a whole page: the link tables are joined and
+        aggregated into arrays, grouped by film work.
+
+        Genres and persons are listed as {"id", "name"} and
+        {"id", "full_name"} objects: distinct by id, so two persons
+        of the same name stay two entries.
+    """
+    http_method_names = ['get']
+
+    fields = ('id', 'title', 'description', 'creation_date', 'rating',
+              'type')
+
+    def get_queryset(self):
+        person = JSONObject(
+            id=F('personfilmwork__person__id'),
+            full_name=F('personfilmwork__person__full_name'))
+        roles = {
+            key: JSONBAgg(person, filter=Q(personfilmwork__role=role),
+                          distinct=True)
+            for role, key in ROLES
+        }
+        return Filmwork.objects.values(*self.fields).annotate(
+            genres=JSONBAgg(JSONObject(id=F('genres__id'),
+                                       name=F('genres__name')),
+                            filter=Q(genres__isnull=False), distinct=True),
+            **roles,
+        )
+
+
+class MoviesListApi(MoviesApiMixin, View):
+    """
+        GET ?page_size=N&cursor=<id>
+
+        Pages by key: film works ordered by id, after `cursor` (the
+        last id of the previous page, given as `next`), so any page
+        is read from the primary key index whatever its depth.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            page_size = int(request.GET.get('page_size', PAGE_SIZE))
+            cursor = request.GET.get('cursor')
+            cursor = None if cursor is None else uuid.UUID(cursor)
+        except ValueError:
+            return HttpResponseBadRequest('page_size must be a number, '
+                                          'cursor a film work id')
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        page = Filmwork.objects.order_by('id')
+        if cursor is not None:
+            page = page.filter(id__gt=cursor)
+        # ids of the page are taken first (a subquery of the same SQL
+        # query), so only their links are joined and aggregated; one
+        # more row tells whether there is a next page
+        queryset = self.get_queryset().filter(
+            id__in=page.values('id')[:page_size + 1]).order_by('id')
+        results = list(queryset)
+        next_cursor = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            next_cursor = results[-1]['id']
+        return JsonResponse({'results': results, 'next': next_cursor})
+
+
+class MoviesDetailApi(MoviesApiMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        try:
+            movie = self.get_queryset().get(pk=kwargs['pk'])
+        except Filmwork.DoesNotExist:
+            raise Http404
+        return JsonResponse(movie)
@@ -0,0 +1,74 @@
+"""Adaptive batch size of the loader
+
+    One AdaptiveBatchSize follows one table while it is loaded.
+    It starts with a small batch and doubles it while rows/sec of
+    written batches keeps growing (by `gain` at least), then goes
+    back to the best size found and stays there. A batch slower
+    than `max_latency` halves the size, and the size never takes
+    more than `memory_limit` bytes of rows (estimated from sampled
+    rows, counted twice: read rows and their serialized copy).
+
+    SQLiteExtractor reads int(sizer) rows per fetch, so the next
+    batch read follows the size decided on the last written one.
+"""
+import sys
+
+
+class AdaptiveBatchSize:
+
+    def __init__(self, start: int = 100, minimum: int = 10,
+                 maximum: int = 100000, memory_limit: int = 64 * 2 ** 20,
+                 max_latency: float = 5.0, gain: float = 1.1):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.memory_limit = memory_limit
+        self.max_latency = max_latency
+        self.gain = gain
+        self.size = max(minimum, min(start, maximum))
+        self.best_size = self.size
+        self.best_rate = 0.0
+        self.settled = False
+        self.row_bytes = None
+
+    def __int__(self) -> int:
+        return self.size
+
+    def ceiling(self) -> int:
+        if not self.row_bytes:
+            return self.maximum
+        fits = int(self.memory_limit // (2 * self.row_bytes))
+        return max(self.minimum, min(self.maximum, fits))
+
+    def measure_rows(self, batch: list, samples: int = 20):
+        """Running estimate of memory taken by one row"""
+        step = max(1, len(batch) // samples)
+        sampled = batch[::step]
+        row_bytes = sum(sys.getsizeof(row) + sum(map(sys.getsizeof, row))
+                        for row in sampled) / len(sampled)
+        self.row_bytes = (row_bytes if self.row_bytes is None
+                          else 0.8 * self.row_bytes + 0.2 * row_bytes)
+
+    def observe(self, batch: list, seconds: float):
+        """Take a written batch and its write latency into account"""
+        if not batch:
+            return
+        self.measure_rows(batch)
+        if seconds > self.max_latency:
+            self.size = max(self.minimum, self.size // 2)
+            self.best_size = min(self.best_size, self.size)
+            return
+        # the last, shorter batch of a table says nothing about size
+        if len(batch) < self.size or seconds <= 0:
+            self.size = min(self.size, self.ceiling())
+            return
+        rate = len(batch) / seconds
+        if not self.settled:
+            if rate > self.best_rate * self.gain:
+                self.best_rate, self.best_size = rate, self.size
+                grown = min(self.size * 2, self.ceiling())
+                self.settled = grown <= self.size
+                self.size = grown
+            else:
+                self.size = self.best_size
+                self.settled = True
+        self.size = min(self.size, self.ceiling())
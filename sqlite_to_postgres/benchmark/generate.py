@@ -0,0 +1,173 @@
+"""Synthetic SQLite source for loader benchmarks
+
+    Builds a db.sqlite with the same film_work / genre / person /
+    link tables as the real dump. Scale is given by the number of
+    person_film_work rows, other tables follow the fan-out of the
+    real data: ~6 persons and ~2 genres per film, a person plays
+    in ~1.5 films, 26 genres.
+
+    Ids are md5 of (table, row number) formatted as uuid: random-looking
+    like real uuid4 keys, but reproducible and computed on the fly, so
+    the generator needs constant memory at any scale.
+
+    usage (from sqlite_to_postgres/):
+        python -m benchmark.generate bench.sqlite --scale 1m
+"""
+import argparse
+import random
+import sqlite3
+from hashlib import md5
+from datetime import datetime, timedelta
+
+SCALES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+}
+
+PERSONS_PER_FILM = 6
+GENRES_PER_FILM = 2
+FILMS_PER_PERSON = 1.5
+GENRES = 26
+ROLES = ('actor', 'actor', 'actor', 'actor', 'writer', 'director')
+
+SCHEMA = """
+CREATE TABLE film_work (
+    id TEXT PRIMARY KEY, title TEXT NOT NULL, description TEXT,
+    creation_date DATE, file_path TEXT, rating FLOAT, type TEXT NOT NULL,
+    created_at timestamp with time zone, updated_at timestamp with time zone
+);
+CREATE TABLE genre (
+    id TEXT PRIMARY KEY, name TEXT NOT NULL, description TEXT,
+    created_at timestamp with time zone, updated_at timestamp with time zone
+);
+CREATE TABLE person (
+    id TEXT PRIMARY KEY, full_name TEXT NOT NULL,
+    created_at timestamp with time zone, updated_at timestamp with time zone
+);
+CREATE TABLE genre_film_work (
+    id TEXT PRIMARY KEY, film_work_id TEXT NOT NULL, genre_id TEXT NOT NULL,
+    created_at timestamp with time zone
+);
+CREATE TABLE person_film_work (
+    id TEXT PRIMARY KEY, film_work_id TEXT NOT NULL,
+    person_id TEXT NOT NULL, role TEXT NOT NULL,
+    created_at timestamp with time zone
+);
+CREATE UNIQUE INDEX film_work_genre ON genre_film_work
+    (film_work_id, genre_id);
+CREATE UNIQUE INDEX film_work_person_role ON person_film_work
+    (film_work_id, person_id, role);
+"""
+
+WORDS = ('star', 'night', 'war', 'love', 'lost', 'city', 'return', 'dark',
+         'king', 'secret', 'last', 'river', 'dream', 'storm', 'empire')
+NAMES = ('Anna', 'Boris', 'Clara', 'David', 'Elena', 'Fedor', 'George',
+         'Helen', 'Ivan', 'Julia', 'Kirill', 'Lena', 'Mark', 'Nina')
+SURNAMES = ('Ivanov', 'Smith', 'Petrova', 'Brown', 'Sidorov', 'Miller',
+            'Kuznetsova', 'Wilson', 'Popov', 'Taylor', 'Volkova', 'Clark')
+
+START = datetime(2021, 6, 16, 20, 14, 9)
+
+
+def make_id(table: str, num: int) -> str:
+    h = md5(f'{table}:{num}'.encode()).hexdigest()
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+
+def timestamp(num: int) -> str:
+    return (START + timedelta(seconds=num)).isoformat(' ') + '.221855+00'
+
+
+def films(count: int, rnd: random.Random):
+    for num in range(count):
+        title = ' '.join(rnd.choices(WORDS, k=rnd.randint(1, 4)))
+        description = (None if rnd.random() < 0.1 else
+                       ' '.join(rnd.choices(WORDS, k=rnd.randint(10, 120))))
+        yield (make_id('film_work', num), title.capitalize(), description,
+               None, None, round(rnd.uniform(1, 10), 1),
+               rnd.choice(('movie', 'movie', 'movie', 'tv_show')),
+               timestamp(num), timestamp(num))
+
+
+def genres():
+    for num in range(GENRES):
+        yield (make_id('genre', num), f'Genre {num}', None,
+               timestamp(num), timestamp(num))
+
+
+def persons(count: int, rnd: random.Random):
+    for num in range(count):
+        yield (make_id('person', num),
+               f'{rnd.choice(NAMES)} {rnd.choice(SURNAMES)}',
+               timestamp(num), timestamp(num))
+
+
+def genre_film_works(film_count: int, rnd: random.Random):
+    num = 0
+    for film in range(film_count):
+        k = rnd.randint(1, GENRES_PER_FILM * 2 - 1)
+        for genre in rnd.sample(range(GENRES), k):
+            yield (make_id('genre_film_work', num),
+                   make_id('film_work', film), make_id('genre', genre),
+                   timestamp(num))
+            num += 1
+
+
+def person_film_works(links: int, film_count: int, person_count: int,
+                      rnd: random.Random):
+    num = 0
+    for film in range(film_count):
+        k = min(links - num, rnd.randint(1, PERSONS_PER_FILM * 2 - 1))
+        if film == film_count - 1:
+            k = links - num
+        for person in rnd.sample(range(person_count), k):
+            yield (make_id('person_film_work', num),
+                   make_id('film_work', film), make_id('person', person),
+                   rnd.choice(ROLES), timestamp(num))
+            num += 1
+        if num >= links:
+            break
+
+
+def generate(path: str, links: int, seed: int = 1):
+    """Create SQLite file `path` with `links` person_film_work rows"""
+    rnd = random.Random(seed)
+    film_count = max(1, links // PERSONS_PER_FILM)
+    person_count = max(PERSONS_PER_FILM * 2,
+                       int(links / FILMS_PER_PERSON))
+    conn = sqlite3.connect(path)
+    # throwaway file, no need to survive a crash while it is built
+    conn.execute('PRAGMA journal_mode=OFF;')
+    conn.execute('PRAGMA synchronous=OFF;')
+    conn.executescript(SCHEMA)
+    inserts = (
+        ('film_work', 9, films(film_count, rnd)),
+        ('genre', 5, genres()),
+        ('person', 4, persons(person_count, rnd)),
+        ('genre_film_work', 4, genre_film_works(film_count, rnd)),
+        ('person_film_work', 5,
+         person_film_works(links, film_count, person_count, rnd)),
+    )
+    for table_name, width, rows in inserts:
+        marks = ', '.join('?' * width)
+        conn.executemany(f'INSERT INTO {table_name} VALUES ({marks});', rows)
+        conn.commit()
+        count = conn.execute(f'SELECT count(*) FROM {table_name};')
+        print(f'{table_name}: {count.fetchone()[0]} rows')
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic SQLite source for load_data.py')
+    parser.add_argument('path', help='SQLite file to create')
+    parser.add_argument('--scale', choices=SCALES, default='10k',
+                        help='number of person_film_work rows')
+    parser.add_argument('--links', type=int,
+                        help='exact number of person_film_work rows, '
+                             'overrides --scale')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    generate(args.path, args.links or SCALES[args.scale], args.seed)
@@ -0,0 +1,147 @@
+"""Loader benchmark runner
+
+    Loads a SQLite file (see benchmark.generate) into the Postgres db
+    from .env with every write strategy and worker count asked for,
+    and reports rows/sec, peak RSS and time spent on every table.
+    Target tables are truncated before each run. Each run happens in
+    its own child process, so peak RSS belongs to that strategy only.
+
+    usage (from sqlite_to_postgres/):
+        python -m benchmark.run bench.sqlite --workers 1,3
+        python -m benchmark.run bench.sqlite --strategy copy-csv \
+            --json results.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import time
+from contextlib import closing, redirect_stdout
+
+import psycopg2
+
+from load_data import dsl, load_async, load_parallel
+from table_mapping import TABLES
+
+STRATEGIES = {
+    'insert': {'engine': 'insert'},
+    'copy-csv': {'engine': 'copy', 'copy_format': 'csv'},
+    'copy-text': {'engine': 'copy', 'copy_format': 'text'},
+    'copy-binary': {'engine': 'copy', 'copy_format': 'binary'},
+    # reads overlapped with writes by load_async()
+    'copy-csv-pipeline': {'engine': 'copy', 'copy_format': 'csv',
+                          'pipeline': True},
+}
+
+
+def source_counts(sqlite_path: str) -> dict:
+    with closing(sqlite3.connect(sqlite_path)) as conn:
+        return {name: conn.execute(
+                    f'SELECT count(*) FROM {mapping.source};').fetchone()[0]
+                for name, mapping in TABLES.items()}
+
+
+def truncate_target(pg_dsl: dict):
+    tables = ', '.join(f'content.{name}' for name in TABLES)
+    with closing(psycopg2.connect(**pg_dsl)) as conn, conn:
+        conn.cursor().execute(f'TRUNCATE {tables};')
+
+
+def run_once(sqlite_path: str, strategy: str, workers: int,
+             batch_size: int = None) -> dict:
+    """One measured load, meant to be called in a fresh process"""
+    options = dict(STRATEGIES[strategy])
+    pipeline = options.pop('pipeline', False)
+    truncate_target(dsl)
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        if pipeline:
+            tables = asyncio.run(load_async(sqlite_path, dsl,
+                                            workers=workers,
+                                            slicesize=batch_size, **options))
+        else:
+            tables = load_parallel(sqlite_path, dsl, workers=workers,
+                                   slicesize=batch_size, **options)
+    elapsed = time.perf_counter() - started
+    rows = sum(source_counts(sqlite_path).values())
+    return {
+        'strategy': strategy,
+        'workers': workers,
+        'batch_size': batch_size,
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed),
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mib': round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'tables': {name: round(seconds, 3)
+                   for name, seconds in tables.items()},
+    }
+
+
+def run_child(sqlite_path: str, strategy: str, workers: int,
+              batch_size: int = None) -> dict:
+    command = [sys.executable, '-m', 'benchmark.run', sqlite_path,
+               '--child', '--strategy', strategy, '--workers', str(workers)]
+    if batch_size:
+        command += ['--batch-size', str(batch_size)]
+    output = subprocess.run(command, check=True, capture_output=True,
+                            text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def print_report(results: list):
+    names = list(TABLES)
+    header = (['strategy', 'workers', 'rows/s', 'rss MiB', 'total s'] +
+              names)
+    print(' | '.join(header))
+    for result in results:
+        line = [result['strategy'], str(result['workers']),
+                str(result['rows_per_sec']), str(result['peak_rss_mib']),
+                str(result['seconds'])]
+        line += [str(result['tables'].get(name, '-')) for name in names]
+        print(' | '.join(line))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark load_data.py write strategies')
+    parser.add_argument('sqlite', help='source SQLite db file')
+    parser.add_argument('--strategy', action='append',
+                        choices=STRATEGIES,
+                        help='strategy to run, default: all of them')
+    parser.add_argument('--workers', default='1',
+                        help='comma separated worker counts, e.g. 1,3')
+    parser.add_argument('--batch-size', type=int,
+                        help='rows per batch, default depends on engine')
+    parser.add_argument('--json', help='append results as JSON lines here')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    strategies = args.strategy or list(STRATEGIES)
+    worker_counts = [int(count) for count in args.workers.split(',')]
+
+    if args.child:
+        print(json.dumps(run_once(args.sqlite, strategies[0],
+                                  worker_counts[0], args.batch_size)))
+        sys.exit()
+
+    results = []
+    for strategy in strategies:
+        for workers in worker_counts:
+            print(f'[{strategy}, workers: {workers}]', file=sys.stderr)
+            results.append(run_child(args.sqlite, strategy, workers,
+                                     args.batch_size))
+    print_report(results)
+    if args.json:
+        with open(args.json, 'a') as out:
+            for result in results:
+                out.write(json.dumps(result) + '\n')
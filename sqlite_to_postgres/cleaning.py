@@ -0,0 +1,107 @@
+"""Column functions of the loader cleaning stage
+
+    Every function takes all values of one column of a batch (a
+    tuple, after zip(*batch)) and returns the cleaned column as a
+    list, so a batch is cleaned with one pass per column instead
+    of per-row Python calls for every field. Columns get them via
+    Column(clean=..., choices=...) in table_mapping.py, where
+    build_cleaner() puts them together.
+"""
+import functools
+import re
+from datetime import datetime, timezone
+
+# values of movies.models.ElemType, the loader runs without Django
+FILM_TYPES = ('movie', 'tv show')
+
+# Source ratings are on a 0..10 scale. Filmwork.rating of the Django
+# migrations is an integer of 0..100 (its validators): tenths of a
+# point. The FLOAT column of schema_design keeps the source scale.
+RATING_SCALE = 10
+RATING_MIN = 0
+RATING_MAX = 100
+
+# Postgres types of columns needing integer values
+INTEGER_TYPES = frozenset(('smallint', 'integer', 'bigint'))
+
+EARLIEST = datetime(1900, 1, 1, tzinfo=timezone.utc)
+SHORT_OFFSET = re.compile(r'([+-]\d\d)$')
+
+
+def clean_rating(values: tuple) -> list:
+    """Numbers clamped to the source scale (0..10) for a FLOAT column,
+    others to None"""
+    low, high = RATING_MIN / RATING_SCALE, RATING_MAX / RATING_SCALE
+    cleaned = []
+    for value in values:
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            cleaned.append(None)
+            continue
+        # NaN fails every comparison
+        cleaned.append(min(high, max(low, number))
+                       if number == number else None)
+    return cleaned
+
+
+def clean_rating_integer(values: tuple) -> list:
+    """clean_rating() for an integer column: 8.46 -> 85"""
+    return [None if number is None
+            else min(RATING_MAX, max(RATING_MIN,
+                                     round(number * RATING_SCALE)))
+            for number in clean_rating(values)]
+
+
+def _format(moment: datetime) -> str:
+    return moment.isoformat(sep=' ', timespec='microseconds')
+
+
+@functools.lru_cache(maxsize=65536)
+def _timestamp(value: str) -> tuple:
+    """(UTC datetime, its text) of a timestamp text, None if it is
+    not one; does not depend on the time of the call"""
+    try:
+        moment = datetime.fromisoformat(
+            SHORT_OFFSET.sub(r'\1:00', value.strip()))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        # the source keeps UTC
+        moment = moment.replace(tzinfo=timezone.utc)
+    moment = max(EARLIEST, moment.astimezone(timezone.utc))
+    return moment, _format(moment)
+
+
+def clean_timestamp(values: tuple) -> list:
+    """
+        Timestamp texts of any precision and offset form to one
+        UTC form with microseconds, clamped to EARLIEST..now;
+        values which are not timestamps become None.
+        Values repeat a lot (rows created by one import), so
+        parsing is cached by value, the clamp to now is not.
+    """
+    latest = datetime.now(timezone.utc)
+    cleaned = []
+    for value in values:
+        parsed = None if value is None else _timestamp(str(value))
+        if parsed is None:
+            cleaned.append(None)
+        else:
+            moment, text = parsed
+            cleaned.append(_format(latest) if moment > latest else text)
+    return cleaned
+
+
+def fill_null(default):
+    """Column function replacing None (NULL) with `default`"""
+    def fill(values: tuple) -> list:
+        return [default if value is None else value for value in values]
+    return fill
+
+
+def normalize_choice(values: tuple) -> list:
+    """'TV_Show ' -> 'tv show', values are checked by choices after"""
+    return [None if value is None
+            else ' '.join(str(value).replace('_', ' ').lower().split())
+            for value in values]
@@ -0,0 +1,258 @@
+"""Chunked-checksum consistency check of SQLite source and Postgres target
+
+    Every table from table_mapping is split to id-ordered chunks of
+    `chunk_size` rows (boundaries are taken from the source). For every
+    chunk both sides compute row count and md5 of normalized rows:
+    Postgres with md5(string_agg(...)), SQLite with a registered md5
+    aggregate over the same row text. Only chunks whose hashes differ
+    are drilled down: per-row hashes of the chunk are compared and the
+    ids of missing, extra and changed rows are reported.
+
+    Row text normalization: uuids as lowercase text, timestamps cut
+    to seconds (UTC), dates to YYYY-MM-DD, floats to 3 decimals,
+    NULL as \\N, columns separated by a tab.
+
+    usage (from sqlite_to_postgres/):
+        python consistency.py --sqlite db.sqlite --chunk-size 10000
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+from contextlib import closing
+from dataclasses import dataclass, field
+
+import psycopg2
+from dotenv import load_dotenv
+
+from table_mapping import TABLES, Column, TableMapping
+
+load_dotenv()
+
+dsl = {
+    'dbname': os.environ.get('DB_NAME'),
+    'user': os.environ.get('DB_USER'),
+    'password': os.environ.get('DB_PASSWORD'),
+    'host': os.environ.get('DB_HOST'),
+    'port': os.environ.get('DB_PORT'),
+    'options': '-c search_path=content -c timezone=UTC',
+}
+
+NULL = '\\N'
+
+
+@dataclass
+class ChunkDiff:
+    table: str
+    # id range [low, high), None means unbounded
+    low: str
+    high: str
+    source_rows: int
+    target_rows: int
+    missing: list = field(default_factory=list)
+    extra: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+
+
+class Md5Aggregate:
+    """SQLite aggregate, md5 of rows joined with newlines,
+    same as md5(string_agg(row, E'\\n')) in Postgres"""
+
+    def __init__(self):
+        self.hash = hashlib.md5()
+        self.first = True
+
+    def step(self, value):
+        if not self.first:
+            self.hash.update(b'\n')
+        self.hash.update(value.encode())
+        self.first = False
+
+    def finalize(self):
+        return None if self.first else self.hash.hexdigest()
+
+
+def sqlite_value_sql(column: Column) -> str:
+    """SQLite expression giving normalized text of a source column"""
+    name = column.source
+    if column.kind == 'uuid':
+        value = f'lower({name})'
+    elif column.kind == 'timestamp':
+        value = f'substr({name}, 1, 19)'
+    elif column.kind == 'date':
+        value = f'substr({name}, 1, 10)'
+    elif column.kind == 'float':
+        # printf('%.3f', NULL) gives '0.000', not NULL
+        value = (f"CASE WHEN {name} IS NULL THEN NULL "
+                 f"ELSE printf('%.3f', {name}) END")
+    else:
+        value = name
+    return f"coalesce({value}, '{NULL}')"
+
+
+def pg_value_sql(column: Column) -> str:
+    """Postgres expression giving normalized text of a target column"""
+    name = column.target
+    if column.kind == 'timestamp':
+        value = f"to_char({name}, 'YYYY-MM-DD HH24:MI:SS')"
+    elif column.kind == 'date':
+        value = f"to_char({name}, 'YYYY-MM-DD')"
+    elif column.kind == 'float':
+        value = f'round({name}::numeric, 3)::text'
+    else:
+        value = f'{name}::text'
+    return f"coalesce({value}, E'\\\\N')"
+
+
+def sqlite_row_sql(mapping: TableMapping) -> str:
+    return ' || char(9) || '.join(map(sqlite_value_sql, mapping.columns))
+
+
+def pg_row_sql(mapping: TableMapping) -> str:
+    return ' || chr(9) || '.join(map(pg_value_sql, mapping.columns))
+
+
+def source_id_sql(sqlite_conn, mapping: TableMapping) -> str:
+    """SQLite expression of ids ordered like Postgres uuids: the id
+    column itself (its primary key index serves ranges and order) when
+    all ids are lowercase, lower(id) (a scan per chunk) otherwise"""
+    mixed_case = sqlite_conn.execute(
+        f"SELECT 1 FROM {mapping.source} WHERE id <> lower(id) "
+        f"LIMIT 1;").fetchone()
+    if mixed_case is None:
+        return 'id'
+    print(f'[{mapping.source}] ids are not lowercase, chunks are read '
+          f'by full scans')
+    return 'lower(id)'
+
+
+def chunk_bounds(sqlite_conn, mapping: TableMapping,
+                 chunk_size: int, id_sql: str = 'id') -> list:
+    """[(low, high), ...] id ranges of about chunk_size source rows,
+    first and last ranges are open so target-only ids are covered"""
+    rows = sqlite_conn.execute(
+        f"SELECT {id_sql} FROM (SELECT id, row_number() OVER "
+        f"(ORDER BY {id_sql}) AS num FROM {mapping.source}) "
+        f"WHERE num % ? = 1 AND num > 1 ORDER BY 1;", (chunk_size,))
+    starts = [None] + [row[0] for row in rows]
+    return list(zip(starts, starts[1:] + [None]))
+
+
+def range_sql(low, high, cast: str = '') -> tuple:
+    conditions, params = [], []
+    if low is not None:
+        conditions.append(f'{{id}} >= %s{cast}')
+        params.append(low)
+    if high is not None:
+        conditions.append(f'{{id}} < %s{cast}')
+        params.append(high)
+    return ' AND '.join(conditions) or 'TRUE', params
+
+
+class TableVerifier:
+
+    def __init__(self, sqlite_conn: sqlite3.Connection, pg_conn,
+                 mapping: TableMapping):
+        self.sqlite = sqlite_conn
+        self.sqlite.create_aggregate('md5_agg', 1, Md5Aggregate)
+        self.pg = pg_conn.cursor()
+        self.mapping = mapping
+        self.sqlite_row = sqlite_row_sql(mapping)
+        self.pg_row = pg_row_sql(mapping)
+        self.id_sql = source_id_sql(sqlite_conn, mapping)
+
+    def sqlite_where(self, low, high) -> tuple:
+        where, params = range_sql(low, high)
+        return where.format(id=self.id_sql).replace('%s', '?'), params
+
+    def pg_where(self, low, high) -> tuple:
+        where, params = range_sql(low, high, '::uuid')
+        return where.format(id='id'), params
+
+    def chunk_hashes(self, low, high) -> tuple:
+        where, params = self.sqlite_where(low, high)
+        source = self.sqlite.execute(
+            f"SELECT count(*), md5_agg(row) FROM (SELECT {self.sqlite_row} "
+            f"AS row FROM {self.mapping.source} WHERE {where} "
+            f"ORDER BY {self.id_sql});", params).fetchone()
+        where, params = self.pg_where(low, high)
+        self.pg.execute(
+            f"SELECT count(*), md5(string_agg({self.pg_row}, E'\\n' "
+            f"ORDER BY id)) FROM content.{self.mapping.target} "
+            f"WHERE {where};", params)
+        target = self.pg.fetchone()
+        return tuple(source), tuple(target)
+
+    def row_hashes(self, low, high) -> tuple:
+        where, params = self.sqlite_where(low, high)
+        source = dict(self.sqlite.execute(
+            f"SELECT {self.id_sql}, {self.sqlite_row} "
+            f"FROM {self.mapping.source} WHERE {where};", params))
+        where, params = self.pg_where(low, high)
+        self.pg.execute(
+            f"SELECT id::text, {self.pg_row} "
+            f"FROM content.{self.mapping.target} WHERE {where};", params)
+        target = dict(tuple(row) for row in self.pg.fetchall())
+        return source, target
+
+    def verify(self, chunk_size: int = 10000) -> list:
+        diffs = []
+        for low, high in chunk_bounds(self.sqlite, self.mapping, chunk_size,
+                                      self.id_sql):
+            source, target = self.chunk_hashes(low, high)
+            if source == target:
+                continue
+            rows_source, rows_target = self.row_hashes(low, high)
+            diffs.append(ChunkDiff(
+                table=self.mapping.target, low=low, high=high,
+                source_rows=source[0], target_rows=target[0],
+                missing=sorted(rows_source.keys() - rows_target.keys()),
+                extra=sorted(rows_target.keys() - rows_source.keys()),
+                changed=sorted(key for key in
+                               rows_source.keys() & rows_target.keys()
+                               if rows_source[key] != rows_target[key]),
+            ))
+        return diffs
+
+
+def verify_all(sqlite_conn, pg_conn, chunk_size: int = 10000,
+               tables: list = None) -> dict:
+    """{table name: [ChunkDiff, ...]}, empty lists mean equal tables"""
+    return {name: TableVerifier(sqlite_conn, pg_conn,
+                                TABLES[name]).verify(chunk_size)
+            for name in tables or TABLES}
+
+
+def print_report(report: dict):
+    for table_name, diffs in report.items():
+        if not diffs:
+            print(f'[{table_name}] OK')
+            continue
+        print(f'[{table_name}] {len(diffs)} chunk(s) differ')
+        for diff in diffs:
+            print(f'  ids [{diff.low or "-inf"}, {diff.high or "+inf"}): '
+                  f'source {diff.source_rows} rows, target '
+                  f'{diff.target_rows} rows')
+            for kind in ('missing', 'extra', 'changed'):
+                ids = getattr(diff, kind)
+                if ids:
+                    print(f'    {kind} ({len(ids)}): {", ".join(ids[:10])}'
+                          f'{" ..." if len(ids) > 10 else ""}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare SQLite source and Postgres target tables')
+    parser.add_argument('--sqlite', default='db.sqlite',
+                        help='source SQLite db file')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--table', action='append', choices=TABLES,
+                        help='table to check, default: all of them')
+    args = parser.parse_args()
+    with closing(sqlite3.connect(args.sqlite)) as sqlite_conn, \
+            closing(psycopg2.connect(**dsl)) as pg_conn:
+        result = verify_all(sqlite_conn, pg_conn, args.chunk_size,
+                            args.table)
+    print_report(result)
+    sys.exit(1 if any(result.values()) else 0)
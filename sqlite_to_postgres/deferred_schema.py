@@ -0,0 +1,245 @@
+"""Deferred index and foreign key build for bulk loads
+
+    deferred_schema() captures secondary indexes and foreign keys of
+    the target tables, drops them for the time of the load and builds
+    them back afterwards: indexes in parallel on separate connections,
+    foreign keys added NOT VALID and then validated in parallel.
+    Primary keys and constraint-backed indexes are kept, the loader
+    needs them for ON CONFLICT (id).
+
+    Captured DDL is committed to public.loader_deferred_ddl before
+    anything is dropped and removed only after it is rebuilt, so the
+    schema is restored when the load fails, and a run killed in the
+    middle is repaired by the next deferred_schema() or restore_pending().
+    Restoring is idempotent: foreign keys already in the catalog are
+    not added again, only validated if they are not valid yet. A
+    foreign key failing VALIDATE (orphan rows were loaded while it was
+    dropped) stays NOT VALID, which still checks new rows, and is
+    reported with its orphan count instead of failing the restore.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+
+import psycopg2
+
+STATE_TABLE = 'public.loader_deferred_ddl'
+
+INDEXES_SQL = """
+SELECT tbl.relname, idx.relname, pg_get_indexdef(idx.oid)
+FROM pg_index x
+JOIN pg_class idx ON idx.oid = x.indexrelid
+JOIN pg_class tbl ON tbl.oid = x.indrelid
+JOIN pg_namespace ns ON ns.oid = tbl.relnamespace
+WHERE ns.nspname = 'content' AND tbl.relname = ANY(%s)
+  AND NOT EXISTS (SELECT 1 FROM pg_constraint con
+                  WHERE con.conindid = idx.oid
+                    AND con.contype IN ('p', 'u', 'x'));
+"""
+
+FOREIGN_KEYS_SQL = """
+SELECT tbl.relname, con.conname, pg_get_constraintdef(con.oid)
+FROM pg_constraint con
+JOIN pg_class tbl ON tbl.oid = con.conrelid
+JOIN pg_namespace ns ON ns.oid = tbl.relnamespace
+WHERE ns.nspname = 'content' AND tbl.relname = ANY(%s)
+  AND con.contype = 'f';
+"""
+
+EXISTING_FOREIGN_KEYS_SQL = """
+SELECT tbl.relname, con.conname, con.convalidated
+FROM pg_constraint con
+JOIN pg_class tbl ON tbl.oid = con.conrelid
+JOIN pg_namespace ns ON ns.oid = tbl.relnamespace
+WHERE ns.nspname = 'content' AND con.contype = 'f';
+"""
+
+FOREIGN_KEY_COLUMNS_SQL = """
+SELECT array_agg(quote_ident(col.attname) ORDER BY k.n),
+       quote_ident(refns.nspname) || '.' || quote_ident(ref.relname),
+       array_agg(quote_ident(refcol.attname) ORDER BY k.n)
+FROM pg_constraint con
+JOIN pg_class tbl ON tbl.oid = con.conrelid
+JOIN pg_namespace ns ON ns.oid = tbl.relnamespace
+JOIN pg_class ref ON ref.oid = con.confrelid
+JOIN pg_namespace refns ON refns.oid = ref.relnamespace
+CROSS JOIN LATERAL unnest(con.conkey, con.confkey)
+    WITH ORDINALITY AS k(attnum, refattnum, n)
+JOIN pg_attribute col ON col.attrelid = con.conrelid
+                     AND col.attnum = k.attnum
+JOIN pg_attribute refcol ON refcol.attrelid = con.confrelid
+                        AND refcol.attnum = k.refattnum
+WHERE ns.nspname = 'content' AND tbl.relname = %s AND con.conname = %s
+GROUP BY refns.nspname, ref.relname;
+"""
+
+
+def ensure_state_table(curs):
+    curs.execute(
+        f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} ("
+        f"kind TEXT NOT NULL, table_name TEXT NOT NULL, name TEXT NOT NULL, "
+        f"definition TEXT NOT NULL, PRIMARY KEY (kind, table_name, name));")
+
+
+def capture(curs, tables: list) -> list:
+    """[(kind, table, name, definition)] of indexes and foreign keys"""
+    curs.execute(INDEXES_SQL, (list(tables),))
+    objects = [('index', *row) for row in curs.fetchall()]
+    curs.execute(FOREIGN_KEYS_SQL, (list(tables),))
+    # a key left NOT VALID by an earlier restore is put back valid
+    objects += [('fkey', table_name, name,
+                 definition.removesuffix(' NOT VALID'))
+                for table_name, name, definition in curs.fetchall()]
+    return objects
+
+
+def drop(pg_dsl: dict, tables: list) -> list:
+    """Save DDL of deferred objects, then drop them, in one transaction"""
+    with closing(psycopg2.connect(**pg_dsl)) as conn, conn:
+        curs = conn.cursor()
+        ensure_state_table(curs)
+        objects = capture(curs, tables)
+        for kind, table_name, name, definition in objects:
+            curs.execute(
+                f"INSERT INTO {STATE_TABLE} VALUES (%s, %s, %s, %s) "
+                f"ON CONFLICT DO NOTHING;",
+                (kind, table_name, name, definition))
+        # foreign keys first, an index may be used by one of them
+        for kind, table_name, name, _ in sorted(
+                objects, key=lambda obj: obj[0] != 'fkey'):
+            if kind == 'fkey':
+                curs.execute(f'ALTER TABLE content.{table_name} '
+                             f'DROP CONSTRAINT "{name}";')
+            else:
+                curs.execute(f'DROP INDEX content."{name}";')
+    print(f'[deferred {len(objects)} indexes and foreign keys]')
+    return objects
+
+
+def forget(curs, kind: str, table_name: str, name: str):
+    curs.execute(f"DELETE FROM {STATE_TABLE} WHERE kind = %s AND "
+                 f"table_name = %s AND name = %s;", (kind, table_name, name))
+
+
+def _run(pg_dsl: dict, statements: list, maintenance_work_mem: str,
+         done: tuple):
+    with closing(psycopg2.connect(**pg_dsl)) as conn, conn:
+        curs = conn.cursor()
+        curs.execute("SET maintenance_work_mem = %s;",
+                     (maintenance_work_mem,))
+        for statement in statements:
+            curs.execute(statement)
+        forget(curs, *done)
+
+
+def count_orphans(curs, table_name: str, name: str) -> int:
+    """Rows of table_name whose foreign key `name` has no parent"""
+    curs.execute(FOREIGN_KEY_COLUMNS_SQL, (table_name, name))
+    columns, parent, parent_columns = curs.fetchone()
+    curs.execute(
+        f"SELECT count(*) FROM content.{table_name} AS child WHERE "
+        + ' AND '.join(f'child.{column} IS NOT NULL' for column in columns)
+        + f" AND NOT EXISTS (SELECT 1 FROM {parent} AS parent WHERE "
+        + ' AND '.join(f'parent.{parent_column} = child.{column}'
+                       for column, parent_column
+                       in zip(columns, parent_columns))
+        + ');')
+    return curs.fetchone()[0]
+
+
+def _validate(pg_dsl: dict, table_name: str, name: str,
+              maintenance_work_mem: str):
+    """VALIDATE one foreign key, None when it passes, else the number
+    of orphan rows; the state row is forgotten in both cases"""
+    with closing(psycopg2.connect(**pg_dsl)) as conn:
+        curs = conn.cursor()
+        orphans = None
+        try:
+            with conn:
+                curs.execute("SET maintenance_work_mem = %s;",
+                             (maintenance_work_mem,))
+                curs.execute(f'ALTER TABLE content.{table_name} '
+                             f'VALIDATE CONSTRAINT "{name}";')
+        except psycopg2.IntegrityError:
+            with conn:
+                orphans = count_orphans(curs, table_name, name)
+        with conn:
+            forget(curs, 'fkey', table_name, name)
+    return orphans
+
+
+def restore_pending(pg_dsl: dict, workers: int = 4,
+                    maintenance_work_mem: str = '256MB') -> dict:
+    """Build back everything recorded in the state table,
+    returns {(table, foreign key): orphan rows} of foreign keys left
+    NOT VALID"""
+    with closing(psycopg2.connect(**pg_dsl)) as conn, conn:
+        curs = conn.cursor()
+        ensure_state_table(curs)
+        curs.execute(f"SELECT kind, table_name, name, definition "
+                     f"FROM {STATE_TABLE};")
+        objects = curs.fetchall()
+        curs.execute(EXISTING_FOREIGN_KEYS_SQL)
+        # {(table, name): validated} of foreign keys in the catalog
+        existing = {(table_name, name): validated
+                    for table_name, name, validated in curs.fetchall()}
+    if not objects:
+        return {}
+    print(f'[rebuild {len(objects)} indexes and foreign keys]')
+    indexes = [obj for obj in objects if obj[0] == 'index']
+    fkeys = [obj for obj in objects if obj[0] == 'fkey']
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run, pg_dsl, [definition + ';'],
+                               maintenance_work_mem,
+                               (kind, table_name, name))
+                   for kind, table_name, name, definition in indexes]
+        for future in futures:
+            future.result()
+    # NOT VALID is instant, the data check runs in VALIDATE, which
+    # holds a weaker lock and may run for all tables at the same time
+    # (a previous restore may have added some of them already)
+    with closing(psycopg2.connect(**pg_dsl)) as conn, conn:
+        curs = conn.cursor()
+        for kind, table_name, name, definition in fkeys:
+            if (table_name, name) not in existing:
+                curs.execute(f'ALTER TABLE content.{table_name} '
+                             f'ADD CONSTRAINT "{name}" {definition} '
+                             f'NOT VALID;')
+            elif existing[table_name, name]:
+                forget(curs, kind, table_name, name)
+    pending = [(table_name, name) for _, table_name, name, _ in fkeys
+               if not existing.get((table_name, name))]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {key: pool.submit(_validate, pg_dsl, *key,
+                                    maintenance_work_mem)
+                   for key in pending}
+        failed = {key: future.result() for key, future in futures.items()}
+    failed = {key: orphans for key, orphans in failed.items()
+              if orphans is not None}
+    for (table_name, name), orphans in failed.items():
+        print(f'[{table_name}] ERROR, foreign key {name} left NOT VALID: '
+              f'{orphans} orphan rows, delete them and run '
+              f'ALTER TABLE content.{table_name} VALIDATE CONSTRAINT '
+              f'"{name}";')
+    return failed
+
+
+@contextmanager
+def deferred_schema(pg_dsl: dict, tables: list, workers: int = 4,
+                    maintenance_work_mem: str = '256MB'):
+    """Drop secondary indexes and foreign keys of `tables` for the
+    time of the block, build them back whatever the block outcome"""
+    # leftovers of a killed run must be back before capturing again
+    restore_pending(pg_dsl, workers, maintenance_work_mem)
+    drop(pg_dsl, tables)
+    try:
+        yield
+    except BaseException:
+        # the load error is the one to report, the state table keeps
+        # what could not be rebuilt for the next run
+        try:
+            restore_pending(pg_dsl, workers, maintenance_work_mem)
+        except Exception as error:
+            print(f'[schema restore failed, left for the next run: '
+                  f'{error}]')
+        raise
+    restore_pending(pg_dsl, workers, maintenance_work_mem)
@@ -0,0 +1,103 @@
+"""Referential pre-validation of link tables
+
+    LinkValidator remembers ids of parent tables (film_work, genre,
+    person) as they are saved, packed to 16 bytes each, and checks
+    every link table batch against them before it is sent:
+    - rows whose mapping.references point to an unknown parent id
+      are orphans,
+    - rows repeating mapping.unique columns of an earlier row are
+      duplicates (the models declare them unique_together).
+    Such rows are dropped from the batch, written to the reject file
+    and counted by reason, so one dirty row does not fail a batch
+    and Postgres does not look up parents of rows known to be bad.
+
+    Parents must be saved earlier in the same run, which holds for
+    full loads (sequential, parallel or async, all of them respect
+    mapping.depends_on) but not for the incremental mode.
+"""
+import threading
+
+from table_mapping import TABLES, TableMapping
+
+
+def pack_uuid(value) -> bytes:
+    """16-byte form of a uuid text in any case, with or without dashes,
+    None for values which are not uuids"""
+    try:
+        packed = bytes.fromhex(str(value).replace('-', ''))
+    except ValueError:
+        return None
+    return packed if len(packed) == 16 else None
+
+
+class LinkValidator:
+    """
+        saved(mapping, batch)  - remember ids of a saved parent batch
+        check(mapping, batch)  - rows of a link batch which may go to
+                                 Postgres, the others are reported
+                                 to `rejects` (see load_data.RejectFile)
+        summary()              - {table: {reason: dropped rows}}
+    """
+
+    def __init__(self, rejects=None):
+        self.rejects = rejects
+        self.parents = {parent for mapping in TABLES.values()
+                        for _, parent in mapping.references}
+        self.ids = {table_name: set() for table_name in self.parents}
+        # packed unique keys of accepted rows, per link table
+        self.keys = {}
+        self.dropped = {}
+        self.lock = threading.Lock()
+
+    def saved(self, mapping: TableMapping, batch: list):
+        if mapping.target not in self.parents:
+            return
+        key = mapping.position('id')
+        ids = self.ids[mapping.target]
+        ids.update(map(pack_uuid, (row[key] for row in batch)))
+        # a malformed parent id must not match a malformed child one
+        ids.discard(None)
+
+    def drop(self, mapping: TableMapping, row: tuple, reason: str):
+        with self.lock:
+            dropped = self.dropped.setdefault(mapping.target, {})
+            dropped[reason] = dropped.get(reason, 0) + 1
+        if self.rejects is not None:
+            self.rejects.write(mapping.target, row, reason)
+
+    def check(self, mapping: TableMapping, batch: list) -> list:
+        if not mapping.references and not mapping.unique:
+            return batch
+        references = [(mapping.position(column), self.ids[parent],
+                       f'orphan: {column} not in {parent}')
+                      for column, parent in mapping.references]
+        unique = [mapping.position(column) for column in mapping.unique]
+        reason_duplicate = f'duplicate: ({", ".join(mapping.unique)})'
+        keys = self.keys.setdefault(mapping.target, set())
+        kept = []
+        for row in batch:
+            for position, parent_ids, reason in references:
+                if pack_uuid(row[position]) not in parent_ids:
+                    self.drop(mapping, row, reason)
+                    break
+            else:
+                if unique:
+                    key = b''.join(pack_uuid(row[position]) or b''
+                                   for position in unique)
+                    if key in keys:
+                        self.drop(mapping, row, reason_duplicate)
+                        continue
+                    keys.add(key)
+                kept.append(row)
+        return kept
+
+    def summary(self) -> dict:
+        return {table_name: dict(reasons)
+                for table_name, reasons in self.dropped.items()}
+
+    def report(self):
+        for table_name, reasons in self.summary().items():
+            detail = ', '.join(f'{reason}: {count}'
+                               for reason, count in reasons.items())
+            print(f'[{table_name}] dropped {sum(reasons.values())} rows '
+                  f'({detail})')
@@ -1,13 +1,35 @@
+import argparse
+import asyncio
+import io
+import functools
+import json
+import multiprocessing
 import sqlite3
+import sys
+import threading
+import time
+import traceback
 import psycopg2
 import os
-import uuid
-from itertools import islice
+import re
+import struct
+from datetime import date, datetime, timedelta, timezone
+from queue import Empty
+from urllib.parse import quote
 from psycopg2.extensions import connection as _connection
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
+from psycopg2.pool import SimpleConnectionPool
 from dotenv import load_dotenv
-from contextlib import contextmanager
-from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import closing, contextmanager, nullcontext
+from dataclasses import dataclass
+from deferred_schema import deferred_schema
+from batch_size import AdaptiveBatchSize
+from link_check import LinkValidator
+from metrics import LoadMetrics
+from staging import STAGING, staged_swap
+from table_mapping import (TABLES, TableMapping, build_cleaner,
+                           build_converter)
 
 
 load_dotenv()
@@ -22,77 +44,398 @@ dsl = {
 }
 
 
+def open_source(db_path: str, check_same_thread: bool = True,
+                mmap_size: int = 2 ** 30) -> sqlite3.Connection:
+    """Open the source db read-only and immutable (no locks, no
+    change checks, the dump must not change while it is read),
+    pages are read through mmap instead of read() calls"""
+    uri = f'file:{quote(os.path.abspath(db_path))}?mode=ro&immutable=1'
+    conn = sqlite3.connect(uri, uri=True,
+                           check_same_thread=check_same_thread)
+    conn.execute(f'PRAGMA mmap_size = {int(mmap_size)};')
+    return conn
+
+
 @contextmanager
 def conn_context(db_path: str):
-    conn = sqlite3.connect(db_path)
+    conn = open_source(db_path)
     conn.row_factory = sqlite3.Row
     yield conn
     conn.close()
 
 
 @dataclass
-class Movie:
-    type: str
-    title: str
-    description: str
-    creation_date: str
-    file_path: str
-    created_at: str
-    updated_at: str
-    rating: float = field(default=0.0)
-    id: uuid.UUID = field(default_factory=uuid.uuid4)
+class DataContainer:
+    # target table name: list of rows
+    tables: dict
 
 
-@dataclass
-class Genre:
-    name: str
-    created_at: str
-    updated_at: str
-    description: str
-    id: uuid.UUID = field(default_factory=uuid.uuid4)
+def sqlite_batches(cursor, arraysize=1000):
+    """Yield lists of at most `arraysize` rows,
+    only one fetchmany() slice is kept in memory at a time.
+    arraysize may be an AdaptiveBatchSize, read before every fetch"""
+    while True:
+        results = cursor.fetchmany(int(arraysize))
+        if not results:
+            break
+        yield results
 
 
-@dataclass
-class Person:
-    full_name: str
-    created_at: str
-    updated_at: str
-    id: uuid.UUID = field(default_factory=uuid.uuid4)
+def chunked(mdata: list, size: int):
+    """Split already materialized list to slices of `size` elements"""
+    for start in range(0, len(mdata), size):
+        yield mdata[start:start + size]
 
 
-@dataclass
-class GenreFilmWork:
-    film_work_id: str
-    genre_id: str
-    created_at: str
-    id: uuid.UUID = field(default_factory=uuid.uuid4)
+def upsert_sql(mapping: TableMapping, source: str,
+               schema: str = 'content') -> str:
+    """
+        INSERT ... ON CONFLICT which rewrites an existing row only
+        when one of its data columns really changed, so a re-run on
+        an up-to-date db does not create new row versions.
+        Query returns one row: (inserted, updated) counts
+    """
+    columns = mapping.target_columns
+    targets = ', '.join(columns)
+    conflict = ', '.join(mapping.conflict_key)
+    changed = [name for name in columns if name not in mapping.conflict_key]
+    set_clause = ', '.join(f'{name}=EXCLUDED.{name}' for name in changed)
+    current = ', '.join(f'target.{name}' for name in changed)
+    incoming = ', '.join(f'EXCLUDED.{name}' for name in changed)
+    return (
+        f"WITH saved AS (INSERT INTO {schema}.{mapping.target} AS target "
+        f"({targets}) {source} ON CONFLICT ({conflict}) "
+        f"DO UPDATE SET {set_clause} "
+        f"WHERE ROW({current}) IS DISTINCT FROM ROW({incoming}) "
+        f"RETURNING xmax = 0 AS inserted) "
+        f"SELECT count(*) FILTER (WHERE inserted), "
+        f"count(*) FILTER (WHERE NOT inserted) FROM saved;")
 
 
-@dataclass
-class PersonFilmWork:
-    film_work_id: str
-    person_id: str
-    role: str
-    created_at: str
-    id: uuid.UUID = field(default_factory=uuid.uuid4)
+def column_types(curs, schema: str, mapping: TableMapping) -> dict:
+    """{column: Postgres type name} of the mapping target table"""
+    curs.execute(
+        "SELECT attname, atttypid::regtype::text FROM pg_attribute "
+        "WHERE attrelid = %s::regclass AND attnum > 0 "
+        "AND NOT attisdropped;", (f'{schema}.{mapping.target}',))
+    return dict(tuple(row) for row in curs.fetchall())
 
 
-@dataclass
-class DataContainer:
-    movies: list
-    genres: list
-    persons: list
-    genre_film_works: list
-    person_film_works: list
+class InsertWriter:
+    """Write engine based on parametrized multi-row INSERT
+    (psycopg2 execute_values), one round-trip per batch"""
+    slicesize = 200
 
+    def __init__(self, curs, schema: str = 'content'):
+        self.curs = curs
+        self.schema = schema
+        self.bytes_sent = 0  # size of the last written batch
 
-def sqliterator(cursor, arraysize=1000):
-    while True:
-        results = cursor.fetchmany(arraysize)
-        if not results:
-            break
-        for item in results:
-            yield item
+    def reset(self, curs):
+        """Continue on another connection"""
+        self.curs = curs
+
+    def write(self, mapping: TableMapping, sql_params: list) -> tuple:
+        counts = execute_values(
+            self.curs, upsert_sql(mapping, 'VALUES %s', self.schema),
+            sql_params,
+            page_size=len(sql_params), fetch=True)
+        self.bytes_sent = len(self.curs.query or b'')
+        return tuple(counts[0])
+
+
+def copy_csv_value(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def copy_text_value(value) -> str:
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class CopyWriter:
+    """Write engine based on COPY ... FROM STDIN
+
+        every batch is serialized to an in-memory buffer in csv or
+        text COPY format, copied into a temporary table and moved
+        to <schema>.<table> with one INSERT ... SELECT, so re-runs
+        still do not create duplicates
+    """
+    slicesize = 10000
+    formats = {
+        'csv': (copy_csv_value, ','),
+        'text': (copy_text_value, '\t'),
+    }
+
+    def __init__(self, curs, copy_format: str = 'csv',
+                 schema: str = 'content'):
+        if copy_format not in self.formats:
+            raise ValueError(f'Unknown COPY format: {copy_format}')
+        self.curs = curs
+        self.schema = schema
+        self.copy_format = copy_format
+        self.staged = set()
+        self.bytes_sent = 0  # size of the last written batch
+
+    def reset(self, curs):
+        """Continue on another connection or after a rollback,
+        temp tables may be gone with the old transaction"""
+        self.curs = curs
+        self.staged.clear()
+
+    def serialize(self, mapping: TableMapping,
+                  sql_params: list) -> io.StringIO:
+        encode, sep = self.formats[self.copy_format]
+        buf = io.StringIO()
+        for row in sql_params:
+            buf.write(sep.join(map(encode, row)))
+            buf.write('\n')
+        # characters, equal to bytes for ascii data
+        self.bytes_sent = buf.tell()
+        buf.seek(0)
+        return buf
+
+    def write(self, mapping: TableMapping, sql_params: list) -> tuple:
+        staging = f'copy_{mapping.target}'
+        if mapping.target not in self.staged:
+            self.curs.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+                f"(LIKE {self.schema}.{mapping.target} INCLUDING DEFAULTS);")
+            self.staged.add(mapping.target)
+        names = ', '.join(mapping.target_columns)
+        self.curs.copy_expert(
+            f"COPY {staging} ({names}) FROM STDIN "
+            f"WITH (FORMAT {self.copy_format});",
+            self.serialize(mapping, sql_params))
+        self.curs.execute(upsert_sql(
+            mapping, f"SELECT {names} FROM {staging}", self.schema))
+        self.bytes_sent += len(self.curs.query or b'')
+        counts = tuple(self.curs.fetchone())
+        self.curs.execute(f"TRUNCATE {staging};")
+        return counts
+
+
+PG_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+PG_EPOCH_DAY = date(2000, 1, 1).toordinal()
+MICROSECOND = timedelta(microseconds=1)
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+BINARY_NULL = struct.pack('>i', -1)
+BINARY_TRAILER = struct.pack('>h', -1)
+SHORT_OFFSET = re.compile(r'([+-]\d\d)$')
+
+
+def parse_timestamp(value) -> datetime:
+    """SQLite timestamp text ('2021-06-16 20:14:09.221855+00'),
+    a bare date or a datetime"""
+    if isinstance(value, datetime):
+        return value
+    # fromisoformat wants +HH:MM offsets before python 3.11
+    return datetime.fromisoformat(SHORT_OFFSET.sub(r'\1:00', str(value)))
+
+
+def binary_uuid(value) -> bytes:
+    try:
+        packed = bytes.fromhex(value.replace('-', ''))
+    except AttributeError:
+        packed = value.bytes  # uuid.UUID
+    if len(packed) != 16:
+        raise ValueError(f'invalid uuid: {value}')
+    return b'\x00\x00\x00\x10' + packed
+
+
+def binary_text(value) -> bytes:
+    data = str(value).encode()
+    return struct.pack('>i', len(data)) + data
+
+
+def binary_integer(code: str, size: int):
+    def encode(value) -> bytes:
+        number = float(value)
+        if not number.is_integer():
+            raise ValueError(f'not an integer: {value}')
+        return struct.pack(f'>i{code}', size, int(number))
+    return encode
+
+
+def binary_date(value) -> bytes:
+    day = (value.date() if isinstance(value, datetime)
+           else date.fromisoformat(str(value)[:10]))
+    return struct.pack('>ii', 4, day.toordinal() - PG_EPOCH_DAY)
+
+
+def binary_timestamp(zone):
+    """Encoder for timestamptz, naive values are taken in `zone`
+    (session TimeZone, as Postgres does for text input)"""
+    @functools.lru_cache(maxsize=65536)
+    def encode(value) -> bytes:
+        moment = parse_timestamp(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=zone)
+        return struct.pack('>iq', 8, (moment - PG_EPOCH) // MICROSECOND)
+    return encode
+
+
+@functools.lru_cache(maxsize=65536)
+def binary_timestamp_naive(value) -> bytes:
+    """Encoder for timestamp without time zone, the offset is
+    dropped, as Postgres does for text input"""
+    moment = parse_timestamp(value).replace(tzinfo=None)
+    return struct.pack('>iq', 8, (moment - PG_EPOCH.replace(tzinfo=None))
+                       // MICROSECOND)
+
+
+class BinaryCopyWriter(CopyWriter):
+    """CopyWriter sending COPY ... (FORMAT binary)
+
+        values are parsed and encoded here, once per batch, in the
+        wire form of the target column type: 16-byte uuids, int64
+        microsecond timestamps, int32 days, float8 ... so Postgres
+        does not parse text. Column types are read from the catalog,
+        the tables created by the DDL and by Django migrations
+        differ (creation_date, rating). A value which can not be
+        encoded fails its batch with psycopg2.DataError.
+    """
+    encoders_by_type = {
+        'uuid': binary_uuid,
+        'text': binary_text,
+        'character varying': binary_text,
+        'double precision': lambda value: struct.pack('>id', 8, float(value)),
+        'real': lambda value: struct.pack('>if', 4, float(value)),
+        'smallint': binary_integer('h', 2),
+        'integer': binary_integer('i', 4),
+        'bigint': binary_integer('q', 8),
+        'date': binary_date,
+        'timestamp without time zone': binary_timestamp_naive,
+    }
+
+    def __init__(self, curs, copy_format: str = 'binary',
+                 schema: str = 'content'):
+        super().__init__(curs, 'csv', schema)
+        self.copy_format = 'binary'
+        self.encoders = {}
+
+    def column_types(self, mapping: TableMapping) -> dict:
+        return column_types(self.curs, self.schema, mapping)
+
+    def session_zone(self):
+        self.curs.execute("SHOW TimeZone;")
+        name = self.curs.fetchone()[0]
+        if name.upper() == 'UTC':
+            return timezone.utc
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(name)
+
+    def table_encoders(self, mapping: TableMapping) -> list:
+        if mapping.target in self.encoders:
+            return self.encoders[mapping.target]
+        types = self.column_types(mapping)
+        encoders = []
+        for name in mapping.target_columns:
+            pg_type = types.get(name)
+            if pg_type == 'timestamp with time zone':
+                encoders.append(binary_timestamp(self.session_zone()))
+            elif pg_type in self.encoders_by_type:
+                encoders.append(self.encoders_by_type[pg_type])
+            else:
+                raise ValueError(f'No binary COPY encoder for '
+                                 f'{mapping.target}.{name} ({pg_type}), '
+                                 f'use csv or text format')
+        self.encoders[mapping.target] = encoders
+        return encoders
+
+    def serialize(self, mapping: TableMapping,
+                  sql_params: list) -> io.BytesIO:
+        encoders = self.table_encoders(mapping)
+        fields = struct.pack('>h', len(encoders))
+        buf = io.BytesIO()
+        write = buf.write
+        write(BINARY_HEADER)
+        try:
+            for row in sql_params:
+                write(fields + b''.join([
+                    BINARY_NULL if value is None else encode(value)
+                    for encode, value in zip(encoders, row)]))
+        except (ValueError, TypeError) as error:
+            raise psycopg2.DataError(f'{mapping.target}: {error}') from error
+        write(BINARY_TRAILER)
+        self.bytes_sent = buf.tell()
+        buf.seek(0)
+        return buf
+
+
+class RejectFile:
+    """Rows refused by Postgres, one JSON line per row:
+    {"table": ..., "error": ..., "row": [...]}, appended to `path`
+    or printed when path is None. May be shared by several savers"""
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.count = 0
+        # {table: rows}, rows of the source which are not in the target
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def write(self, table_name: str, row: tuple, error: Exception):
+        line = json.dumps({'table': table_name,
+                           'error': str(error).strip(),
+                           'row': list(row)}, default=str)
+        with self.lock:
+            self.count += 1
+            self.tables[table_name] = self.tables.get(table_name, 0) + 1
+            if self.path is None:
+                print('[rejected]', line)
+                return
+            with open(self.path, 'a') as reject_file:
+                reject_file.write(line + '\n')
+
+
+class Checkpoints:
+    """Per-table high-watermarks of the incremental load
+
+        (watermark, id) of the last saved row is kept in
+        public.loader_checkpoint, outside of content schema, and
+        is updated in the same transaction as the batch itself,
+        so a restarted run continues after the last committed batch.
+
+        The table is created by Checkpoints.create() once, before
+        the workers start: CREATE TABLE IF NOT EXISTS run by several
+        connections at the same time fails in all but one of them.
+    """
+
+    def __init__(self, curs):
+        self.curs = curs
+
+    @staticmethod
+    def create(pg_dsl: dict):
+        with closing(psycopg2.connect(**pg_dsl)) as conn, conn:
+            conn.cursor().execute(
+                "CREATE TABLE IF NOT EXISTS public.loader_checkpoint ("
+                "table_name TEXT PRIMARY KEY, watermark TEXT NOT NULL, "
+                "last_id TEXT NOT NULL, "
+                "modified TIMESTAMP WITH TIME ZONE DEFAULT now());")
+
+    def get(self, table_name: str):
+        self.curs.execute(
+            "SELECT watermark, last_id FROM public.loader_checkpoint "
+            "WHERE table_name = %s;", (table_name,))
+        row = self.curs.fetchone()
+        return tuple(row) if row else None
+
+    def save(self, table_name: str, watermark: str, last_id: str):
+        self.curs.execute(
+            "INSERT INTO public.loader_checkpoint (table_name, watermark, "
+            "last_id) VALUES (%s, %s, %s) ON CONFLICT (table_name) DO UPDATE "
+            "SET watermark=EXCLUDED.watermark, last_id=EXCLUDED.last_id, "
+            "modified=now();", (table_name, watermark, last_id))
+
+    def reset(self):
+        self.curs.execute("TRUNCATE public.loader_checkpoint;")
 
 
 class PostgresSaver:
@@ -101,131 +444,317 @@ class PostgresSaver:
         save_all_data() - main class to proccess all tables inside DB
                           run all workers
 
+        save() takes a table mapping and an iterable of batches
+        (lists of row tuples), so it works the same for a
+        materialized DataContainer and for batches streamed from
+        SQLiteExtractor
+
+        engine='copy' writes through COPY FROM STDIN (copy_format
+        'csv', 'text' or 'binary'), engine='insert' keeps the
+        executemany path
+
+        incremental=True reads only rows newer than the table
+        checkpoint and commits every batch together with it
+
+        every stage and batch is timed in `metrics`, pass one
+        LoadMetrics to several savers to get a common summary
+
+        schema='content_staging' writes to the staging copy of
+        the tables prepared by staging.staged_swap()
+
+        batch_commit=True commits every batch on its own, retries
+        it on connection errors (a fresh connection needs pg_dsl)
+        and isolates refused rows to `rejects`; callers finish
+        with commit() and close(), the saver may have moved off
+        the connection it was given
+
+        links=LinkValidator() drops orphan and duplicate link rows
+        before they are sent, see link_check.py
+
+        clean=True runs converted batches through the columnar
+        cleaning stage of table_mapping (Column.clean, choices),
+        rows with values out of choices go to `rejects`
+
+        adaptive=True tunes batch size of every table while it
+        loads, up to `memory_limit` bytes of rows per batch, see
+        batch_size.py; slicesize is then the starting size
     """
+    engines = ('copy', 'insert')
+    copy_formats = (*CopyWriter.formats, 'binary')
+    # worth a retry on a fresh connection, other errors are data errors
+    transient_errors = (psycopg2.OperationalError, psycopg2.InterfaceError)
+    # errors caused by the rows themselves, the others (missing table,
+    # privileges, bad SQL) would refuse every row of every batch
+    row_errors = (psycopg2.DataError, psycopg2.IntegrityError)
 
-    def __init__(self, pgcon: _connection):
+    def __init__(self, pgcon: _connection, engine: str = 'copy',
+                 copy_format: str = 'csv', slicesize: int = None,
+                 incremental: bool = False, metrics: LoadMetrics = None,
+                 schema: str = 'content', batch_commit: bool = False,
+                 retries: int = 3, retry_delay: float = 0.5,
+                 rejects: RejectFile = None, pg_dsl: dict = None,
+                 links: LinkValidator = None, adaptive: bool = False,
+                 memory_limit: int = 64 * 2 ** 20, clean: bool = False):
+        self.pgcon = pgcon
         self.curs = pgcon.cursor()
-        self.slicesize = 200  # size of on slice for INSERT
+        self.schema = schema
+        self.metrics = metrics or LoadMetrics()
+        self.checkpoints = Checkpoints(self.curs) if incremental else None
+        self.batch_commit = batch_commit
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.rejects = rejects or RejectFile()
+        self.links = links
+        self.adaptive = adaptive
+        self.clean = clean
+        self.cleaners = {}
+        self.memory_limit = memory_limit
+        # fresh connections after a failure, opened on first need
+        self.pg_dsl = pg_dsl
+        self.pool = None
+        self.pooled = False
+        self.stats = {}
+        self.converters = {}
+        if engine == 'copy' and copy_format == 'binary':
+            self.writer = BinaryCopyWriter(self.curs, copy_format, schema)
+        elif engine == 'copy':
+            self.writer = CopyWriter(self.curs, copy_format, schema)
+        elif engine == 'insert':
+            self.writer = InsertWriter(self.curs, schema)
+        else:
+            raise ValueError(f'Unknown write engine: {engine}')
+        # size of on slice for INSERT / COPY
+        self.slicesize = slicesize or self.writer.slicesize
+        if adaptive and not slicesize:
+            # start small, the table's own throughput decides
+            self.slicesize = 100
+
+    def reconnect(self):
+        """Leave the current connection, go on with one from the pool"""
+        if self.pool is None:
+            self.pool = SimpleConnectionPool(0, 2, **self.pg_dsl,
+                                             cursor_factory=DictCursor)
+        if self.pooled:
+            self.pool.putconn(self.pgcon, close=True)
+        elif not self.pgcon.closed:
+            # caller's connection, the caller closes it
+            try:
+                self.pgcon.rollback()
+            except psycopg2.Error:
+                pass
+        self.pgcon = self.pool.getconn()
+        self.pooled = True
+        self.curs = self.pgcon.cursor()
+        self.writer.reset(self.curs)
+        if self.checkpoints:
+            self.checkpoints.curs = self.curs
+
+    def commit(self):
+        self.pgcon.commit()
+
+    def close(self):
+        """Close pooled connections, if there were failures"""
+        if self.pool is not None:
+            self.pool.closeall()
 
     def save_all_data(self, data: DataContainer):
         self.data = data
-        self.save_movies(self.data.movies)
-        self.save_persons(self.data.persons)
-        self.save_genres(self.data.genres)
-        self.save_genre_film_work(self.data.genre_film_works)
-        self.save_person_film_work(self.data.person_film_works)
+        for table_name, rows in data.tables.items():
+            self.save(TABLES[table_name], chunked(rows, self.slicesize))
+
+    def save_stream(self, extractor: 'SQLiteExtractor'):
+        """Pipe every table from extractor straight to Postgres,
+        batch by batch, without building DataContainer"""
+        for table_name in TABLES:
+            self.save_table(extractor, table_name)
+
+    def save_table(self, extractor: 'SQLiteExtractor', table_name: str):
+        mapping = TABLES[table_name]
+        since = None
+        if self.checkpoints:
+            since = self.checkpoints.get(table_name)
+            print(f'[{table_name} checkpoint: {since}]')
+        sizer = self.batch_sizer()
+        self.save(mapping, extractor.extract(
+            mapping, stream=True, since=since, ordered=bool(self.checkpoints),
+            batch_size=sizer), converted=extractor.converted, sizer=sizer)
+
+    def batch_sizer(self) -> AdaptiveBatchSize:
+        """New batch size controller for a table, None if not adaptive"""
+        if not self.adaptive:
+            return None
+        return AdaptiveBatchSize(start=self.slicesize,
+                                 memory_limit=self.memory_limit)
+
+    def table_stats(self, table_name: str) -> dict:
+        return self.stats.setdefault(
+            table_name, {'inserted': 0, 'updated': 0, 'unchanged': 0})
+
+    def batch_saved(self, mapping: TableMapping, batch: list,
+                    counts: tuple):
+        """Move table checkpoint to the last row of saved batch,
+        commit it if the saver commits batch by batch, then count
+        inserted / updated / unchanged rows"""
+        if self.checkpoints or self.batch_commit:
+            stage = 'checkpoint' if self.checkpoints else 'commit'
+            with self.metrics.stage(mapping.target, stage):
+                if self.checkpoints:
+                    last = batch[-1]
+                    watermark = last[mapping.position(mapping.watermark)]
+                    self.checkpoints.save(mapping.target, watermark or '',
+                                          str(last[mapping.position('id')]))
+                self.pgcon.commit()
+        if self.links:
+            self.links.saved(mapping, batch)
+        inserted, updated = counts
+        stats = self.table_stats(mapping.target)
+        stats['inserted'] += inserted
+        stats['updated'] += updated
+        stats['unchanged'] += len(batch) - inserted - updated
+
+    def write_batch(self, mapping: TableMapping, batch: list,
+                    sql_params: list) -> tuple:
+        """
+            Write one batch, returns (inserted, updated) counts.
+            With batch_commit the batch is its own transaction:
+            connection errors are retried with exponential
+            backoff on a fresh connection, data and integrity
+            errors split the batch in halves until the refused
+            rows are found, those go to the reject file; other
+            errors are raised
+        """
+        if not self.batch_commit:
+            with self.metrics.stage(mapping.target, 'write'):
+                counts = self.writer.write(mapping, sql_params)
+            self.batch_saved(mapping, batch, counts)
+            return counts
+        for attempt in range(self.retries + 1):
+            try:
+                with self.metrics.stage(mapping.target, 'write'):
+                    counts = self.writer.write(mapping, sql_params)
+                self.batch_saved(mapping, batch, counts)
+                return counts
+            except self.transient_errors as error:
+                if attempt == self.retries or self.pg_dsl is None:
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                print(f'[{mapping.target}] {error.__class__.__name__}, '
+                      f'retry {attempt + 1} in {delay}s')
+                time.sleep(delay)
+                self.reconnect()
+            except self.row_errors as error:
+                self.pgcon.rollback()
+                self.writer.reset(self.curs)
+                if len(batch) == 1:
+                    self.reject(mapping, batch[0], error)
+                    return 0, 0
+                half = len(batch) // 2
+                left = self.write_batch(mapping, batch[:half],
+                                        sql_params[:half])
+                right = self.write_batch(mapping, batch[half:],
+                                         sql_params[half:])
+                return left[0] + right[0], left[1] + right[1]
+
+    def validated(self, mapping: TableMapping, batch: list) -> list:
+        """Batch without orphan and duplicate link rows"""
+        if not self.links:
+            return batch
+        with self.metrics.stage(mapping.target, 'validate'):
+            return self.links.check(mapping, batch)
+
+    def cleaned(self, mapping: TableMapping, batch: list,
+                sql_params: list) -> tuple:
+        """(batch, sql_params) after the cleaning stage, without
+        rows it refused"""
+        if not self.clean:
+            return batch, sql_params
+        if mapping.target not in self.cleaners:
+            # ratings are scaled to integers for an integer column
+            self.cleaners[mapping.target] = build_cleaner(
+                mapping, column_types(self.curs, self.schema, mapping))
+        clean = self.cleaners[mapping.target]
+        if clean is None:
+            return batch, sql_params
+        with self.metrics.stage(mapping.target, 'clean'):
+            sql_params, invalid = clean(sql_params)
+            if invalid:
+                for index, reason in invalid.items():
+                    self.reject(mapping, batch[index], reason)
+                batch = [row for index, row in enumerate(batch)
+                         if index not in invalid]
+                sql_params = [row for index, row in enumerate(sql_params)
+                              if index not in invalid]
+        return batch, sql_params
+
+    def reject(self, mapping: TableMapping, row: tuple, error: Exception):
+        stats = self.table_stats(mapping.target)
+        stats['rejected'] = stats.get('rejected', 0) + 1
+        self.rejects.write(mapping.target, row, error)
 
     def save_check(self, count: int, table_name: str):
-        self.curs.execute(f"SELECT COUNT(id) FROM content.{table_name};")
-        saved_count = (self.curs.fetchone())
-        if count == int(saved_count[0]):
-            print('OK, saved:', saved_count[0])
+        stats = self.stats.get(table_name, {})
+        detail = ', '.join(f'{key}: {value}' for key, value in stats.items())
+        # refused rows are in the reject file, not in the table
+        count -= stats.get('rejected', 0)
+        if self.checkpoints:
+            # target holds rows of previous runs too, nothing to compare
+            self.metrics.finish(table_name, **stats)
+            print(f'[{table_name}] OK, new or changed rows saved:', count,
+                  f'({detail})')
+            return
+        with self.metrics.stage(table_name, 'check'):
+            self.curs.execute(
+                f"SELECT COUNT(id) FROM {self.schema}.{table_name};")
+            saved_count = int(self.curs.fetchone()[0])
+        self.metrics.finish(table_name, expected=count, saved=saved_count,
+                            ok=count == saved_count, **stats)
+        if count == saved_count:
+            print(f'[{table_name}] OK, saved:', saved_count, f'({detail})')
         else:
-            print('[ !!! ] ERROR, wrong save count, should be:', count,
-                  'saved:', saved_count[0])
-        print()
-
-    def save_movies(self, mdata: list):
-        print('[Save Movies table in db]')
-        elems_count = len(mdata)
-        slsize = self.slicesize
-        times = elems_count // slsize
-        print('rows to insert:', elems_count)
-        for time in range(times + 1):
-            print('.', end='')
-            sql_params = []
-            for elem in islice(mdata, 0 + (time * slsize),
-                               slsize + (time * slsize)):
-                sql_params.append((elem.id, elem.title, elem.description,
-                                   elem.rating, elem.type, elem.created_at,
-                                   elem.updated_at))
-
-            self.curs.executemany(
-                "INSERT INTO content.film_work (id, title, description, "
-                "creation_date, rating, type, created, modified) VALUES "
-                "(%s, %s, %s, current_timestamp, %s, %s, %s, %s) ON CONFLICT"
-                " (id) DO UPDATE SET id=EXCLUDED.id;", sql_params)
-
-        self.save_check(elems_count, 'film_work')
-
-    def save_persons(self, mdata: list):
-        print('[Save Person table in db]')
-        elems_count = len(mdata)
-        slsize = self.slicesize
-        times = elems_count // slsize
-        print('rows to insert:', elems_count)
-        for time in range(times + 1):
-            print('.', end='')
-            sql_params = []
-            for elem in islice(mdata, 0 + (time * slsize),
-                               slsize + (time * slsize)):
-                sql_params.append((elem.id, elem.full_name,
-                                   elem.created_at, elem.updated_at))
-
-            self.curs.executemany(
-                "INSERT INTO content.person (id, full_name, created, modified)"
-                " VALUES (%s, %s, %s, %s) ON CONFLICT (id) DO UPDATE "
-                "SET id=EXCLUDED.id;", sql_params)
-        self.save_check(elems_count, 'person')
-
-    def save_genres(self, mdata: list):
-        print('[Save Genres table in db]')
-        elems_count = len(mdata)
-        slsize = self.slicesize
-        times = elems_count // slsize
-        print('rows to insert:', elems_count)
-        for time in range(times + 1):
-            print('.', end='')
-            sql_params = []
-            for elem in islice(mdata, 0 + (time * slsize),
-                               slsize + (time * slsize)):
-                sql_params.append((elem.id, elem.name,
-                                   elem.created_at, elem.updated_at))
-
-            self.curs.executemany(
-                "INSERT INTO content.genre (id, name, created, modified) "
-                "VALUES (%s, %s, %s, %s) ON CONFLICT (id) "
-                "DO UPDATE SET id=EXCLUDED.id;", sql_params)
-        self.save_check(elems_count, 'genre')
-
-    def save_genre_film_work(self, mdata: list):
-        print('[Save Genres Film Work table in db]')
-        elems_count = len(mdata)
-        slsize = self.slicesize
-        print('rows to insert:', elems_count)
-        times = elems_count // slsize
-        for time in range(times + 1):
-            print('.', end='')
-            sql_params = []
-            for elem in islice(mdata, 0 + (time * slsize),
-                               slsize + (time * slsize)):
-                sql_params.append((elem.id, elem.film_work_id,
-                                   elem.genre_id, elem.created_at))
-
-            self.curs.executemany(
-                "INSERT INTO content.genre_film_work (id, film_work_id, "
-                "genre_id, created) VALUES (%s, %s, %s, %s) ON CONFLICT (id)"
-                " DO UPDATE SET id=EXCLUDED.id;", sql_params)
-        self.save_check(elems_count, 'genre_film_work')
-
-    def save_person_film_work(self, mdata: list):
-        print('[Save Persons Film Work table in db]')
-        elems_count = len(mdata)
-        slsize = self.slicesize
-        times = elems_count // slsize
-        for time in range(times + 1):
-            print('.', end='')
-            sql_params = []
-            for elem in islice(mdata, 0 + (time * slsize),
-                               slsize + (time * slsize)):
-                sql_params.append((elem.id, elem.film_work_id, elem.person_id,
-                                   elem.role, elem.created_at))
-
-            self.curs.executemany(
-                "INSERT INTO content.person_film_work (id, film_work_id,"
-                " person_id, role, created) VALUES (%s, %s, %s, %s, %s)"
-                " ON CONFLICT (id) DO UPDATE SET id=EXCLUDED.id;", sql_params)
-        self.save_check(elems_count, 'person_film_work')
+            print(f'[{table_name}] ERROR, wrong save count, should be:',
+                  count, 'saved:', saved_count)
+
+    def save(self, mapping: TableMapping, batches, converted: bool = False,
+             sizer: AdaptiveBatchSize = None):
+        """Write all batches of one table, every stage is timed:
+        read (SQLite fetch), convert, write (Postgres round-trip).
+        converted=True: batches come already converted,
+        sizer: told about every batch, the reader follows it"""
+        table_name = mapping.target
+        metrics = self.metrics
+        if table_name not in self.converters:
+            self.converters[table_name] = build_converter(mapping)
+        convert = None if converted else self.converters[table_name]
+        elems_count = 0
+        batches = iter(batches)
+        while True:
+            with metrics.stage(table_name, 'read'):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            batch = self.validated(mapping, batch)
+            if not batch:
+                continue
+            elems_count += len(batch)
+            with metrics.stage(table_name, 'convert'):
+                sql_params = convert(batch) if convert else batch
+            batch, sql_params = self.cleaned(mapping, batch, sql_params)
+            if not batch:
+                continue
+            started = time.perf_counter()
+            self.write_batch(mapping, batch, sql_params)
+            latency = time.perf_counter() - started
+            metrics.batch(table_name, len(batch), latency,
+                          self.writer.bytes_sent)
+            if sizer:
+                sizer.observe(batch, latency)
+        self.sized(table_name, sizer)
+        self.save_check(elems_count, table_name)
+
+    def sized(self, table_name: str, sizer: AdaptiveBatchSize):
+        """Report the batch size a table settled on"""
+        if sizer:
+            self.table_stats(table_name)['batch_size'] = sizer.size
 
 
 class SQLiteExtractor:
@@ -233,76 +762,532 @@ class SQLiteExtractor:
         SQLiteExtractor - class to read selected .sqlite file
                           find predefined Tables.
 
-                          There are 5 workers, one for
-                          each table, this methods return
-                          containers
+                          extract() reads one table described
+                          by a TableMapping and returns a list
+                          of rows, or a generator of batches
+                          with stream=True
     """
-    curs = 0
+    # rows are returned as read, PostgresSaver converts them
+    converted = False
 
-    def __init__(self, connection: sqlite3.Connection):
-        self.curs = connection.cursor()
+    def __init__(self, connection: sqlite3.Connection,
+                 batch_size: int = 200):
+        self.connection = connection
+        self.batch_size = batch_size
         print('[Start read data from SQLite db]')
 
-    def extract_movies(self):
-        self.curs.execute("SELECT * FROM film_work;")
-        print('Get data from film_work')
-        return [Movie(**elem) for elem in sqliterator(self.curs)]
+    def extract(self, mapping: TableMapping, stream: bool = False,
+                since: tuple = None, ordered: bool = False,
+                batch_size=None):
+        """batch_size: int or AdaptiveBatchSize, default self.batch_size"""
+        print('Get data from', mapping.source)
+        # own cursor for every stream, so a lazily consumed
+        # generator is not reset by the next execute(); rows are
+        # plain tuples ordered as mapping columns
+        curs = self.connection.cursor()
+        curs.row_factory = None
+        curs.execute(*self._select(mapping, since, ordered))
+        if stream:
+            return sqlite_batches(curs, batch_size or self.batch_size)
+        return curs.fetchall()
+
+    @staticmethod
+    def _select(mapping: TableMapping, since: tuple = None,
+                ordered: bool = False):
+        """Build SELECT for a table, with ordered=True rows come in
+        (watermark, id) order and start after `since` checkpoint"""
+        columns = ', '.join(mapping.source_columns)
+        if not ordered and since is None:
+            return f"SELECT {columns} FROM {mapping.source};", ()
+        mark = f"COALESCE({mapping.watermark}, '')"
+        where = f"WHERE ({mark}, id) > (?, ?) " if since else ""
+        return (f"SELECT {columns} FROM {mapping.source} {where}"
+                f"ORDER BY {mark}, id;", since or ())
 
-    def extract_persons(self):
-        self.curs.execute("SELECT * FROM person;")
-        print('Get data from person')
-        return [Person(**elem) for elem in sqliterator(self.curs)]
 
-    def extract_genres(self):
-        self.curs.execute("SELECT * FROM genre;")
-        print('Get data from genre')
-        return [Genre(**elem) for elem in sqliterator(self.curs)]
+def read_shard(sqlite_path: str, table_name: str, low: int, high: int,
+               batch_size: int, queue):
+    """Worker process: read and convert rows of one rowid range,
+    put ('rows', batch) messages, then ('done', low) or ('error',
+    traceback text) to the queue"""
+    try:
+        mapping = TABLES[table_name]
+        convert = build_converter(mapping)
+        with closing(open_source(sqlite_path)) as conn:
+            curs = conn.execute(
+                f"SELECT {', '.join(mapping.source_columns)} "
+                f"FROM {mapping.source} WHERE rowid BETWEEN ? AND ?;",
+                (low, high))
+            for batch in sqlite_batches(curs, batch_size):
+                queue.put(('rows', convert(batch) if convert else batch))
+        queue.put(('done', low))
+    except BaseException:
+        queue.put(('error', traceback.format_exc()))
+
+
+class ShardedExtractor(SQLiteExtractor):
+    """
+        ShardedExtractor - SQLiteExtractor reading big tables
+                           in `shards` worker processes, each
+                           one reads a rowid range, converts
+                           rows and sends batches through
+                           a bounded queue, so reading and
+                           converting use several cores.
+                           Batches come in no particular order.
+                           Small tables, and ordered reads of
+                           the incremental mode, are read here
+                           as by SQLiteExtractor
+    """
+    converted = True
 
-    def extract_genresfilmwork(self):
-        self.curs.execute("SELECT * FROM genre_film_work;")
-        print('Get data from genre_film_work')
-        return [GenreFilmWork(**elem) for elem in sqliterator(self.curs)]
+    def __init__(self, connection: sqlite3.Connection,
+                 batch_size: int = 200, shards: int = None,
+                 min_rows: int = 100000):
+        super().__init__(connection, batch_size)
+        self.shards = shards or os.cpu_count()
+        self.min_rows = min_rows
+        # file of the "main" db of the connection
+        self.sqlite_path = connection.execute(
+            'PRAGMA database_list;').fetchone()[2]
 
-    def extract_person_film_work(self):
-        self.curs.execute("SELECT * FROM person_film_work;")
-        print('Get data from person_film_work')
-        return [PersonFilmWork(**elem) for elem in sqliterator(self.curs)]
+    def rowid_ranges(self, mapping: TableMapping) -> list:
+        low, high, count = self.connection.execute(
+            f"SELECT min(rowid), max(rowid), count(*) "
+            f"FROM {mapping.source};").fetchone()
+        if count < self.min_rows or self.shards < 2:
+            return []
+        step = (high - low) // self.shards + 1
+        return [(start, min(start + step - 1, high))
+                for start in range(low, high + 1, step)]
 
+    def extract(self, mapping: TableMapping, stream: bool = False,
+                since: tuple = None, ordered: bool = False,
+                batch_size=None):
+        ranges = [] if ordered or since else self.rowid_ranges(mapping)
+        if not ranges:
+            rows = super().extract(mapping, stream, since, ordered,
+                                   batch_size)
+            convert = build_converter(mapping)
+            if convert is None:
+                return rows
+            return map(convert, rows) if stream else convert(rows)
+        print('Get data from', mapping.source, f'in {len(ranges)} shards')
+        # worker processes can not follow an adaptive size
+        batches = self._sharded(mapping, ranges,
+                                int(batch_size or self.batch_size))
+        return batches if stream else [row for batch in batches
+                                       for row in batch]
 
-def load_from_sqlite(connection: sqlite3.Connection, pg_conn: _connection):
+    # seconds between checks of worker processes while none sends
+    poll_interval = 1.0
+
+    def _sharded(self, mapping: TableMapping, ranges: list,
+                 batch_size: int):
+        # spawn: forking a process with running loader threads
+        # may copy locks held by them
+        context = multiprocessing.get_context('spawn')
+        queue = context.Queue(maxsize=2 * len(ranges))
+        workers = [context.Process(
+            target=read_shard, daemon=True,
+            args=(self.sqlite_path, mapping.target, low, high,
+                  batch_size, queue)) for low, high in ranges]
+        for worker in workers:
+            worker.start()
+        done = set()
+        try:
+            while len(done) < len(workers):
+                try:
+                    kind, payload = queue.get(timeout=self.poll_interval)
+                except Empty:
+                    # killed (OOM) or failed to start: no 'error' comes
+                    dead = [(low, worker.exitcode) for (low, _), worker
+                            in zip(ranges, workers)
+                            if low not in done and worker.exitcode]
+                    if dead:
+                        raise RuntimeError(
+                            f'{mapping.source} shard reader died '
+                            f'(rowid from, exit code): {dead}')
+                    continue
+                if kind == 'rows':
+                    yield payload
+                elif kind == 'done':
+                    done.add(payload)
+                else:
+                    raise RuntimeError(
+                        f'{mapping.source} shard reader failed:\n{payload}')
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+
+def make_extractor(connection: sqlite3.Connection, batch_size: int,
+                   shards: int = 1) -> SQLiteExtractor:
+    if shards > 1:
+        return ShardedExtractor(connection, batch_size, shards)
+    return SQLiteExtractor(connection, batch_size)
+
+
+def load_from_sqlite(connection: sqlite3.Connection, pg_conn: _connection,
+                     stream: bool = True, shards: int = 1, **saver_options):
     """
         load_from_sqlite : Main class, start all work.
                            First: open connections to DB's
                            Second: run Extract data from sqlite,
-                           put them on special datacontainer
+                           by default every table is streamed
+                           in bounded batches, so memory usage
+                           does not depend on source db size.
+                           With stream=False all data is put
+                           on special datacontainer first,
+                           shards > 1 reads streamed tables
+                           in worker processes
                            Third and final: run Data saver,
                            insert all extracted data to
-                           Postrges DB
+                           Postrges DB and commit it
     """
     print("[All connections - ok]")
-    postgres_saver = PostgresSaver(pg_conn)
-    sqlite_extractor = SQLiteExtractor(connection)
+    postgres_saver = PostgresSaver(pg_conn, **saver_options)
+
+    try:
+        if stream:
+            postgres_saver.save_stream(make_extractor(
+                connection, postgres_saver.slicesize, shards))
+        else:
+            sqlite_extractor = SQLiteExtractor(
+                connection, batch_size=postgres_saver.slicesize)
+            data = DataContainer(
+                {table_name: sqlite_extractor.extract(mapping)
+                 for table_name, mapping in TABLES.items()})
+            print()
+            postgres_saver.save_all_data(data)
+        postgres_saver.commit()
+    finally:
+        postgres_saver.close()
+
+
+def load_table(table_name: str, sqlite_path: str, pg_dsl: dict,
+               shards: int = 1, **saver_options) -> float:
+    """Load one table on its own SQLite and Postgres connections,
+    the table is committed when the function returns.
+    Returns time spent on the table, in seconds"""
+    started = time.perf_counter()
+    with conn_context(sqlite_path) as sqlite_conn, \
+            closing(psycopg2.connect(**pg_dsl,
+                                     cursor_factory=DictCursor)) as pg_conn:
+        saver_options.setdefault('pg_dsl', pg_dsl)
+        postgres_saver = PostgresSaver(pg_conn, **saver_options)
+        sqlite_extractor = make_extractor(
+            sqlite_conn, postgres_saver.slicesize, shards)
+        try:
+            postgres_saver.save_table(sqlite_extractor, table_name)
+            postgres_saver.commit()
+        finally:
+            postgres_saver.close()
+    return time.perf_counter() - started
+
+
+def load_parallel(sqlite_path: str, pg_dsl: dict, workers: int = 3,
+                  **saver_options) -> dict:
+    """
+        load_parallel : run load_table() for every table in a pool
+                        of `workers` threads. Tables without
+                        dependencies start at once, link tables
+                        start as soon as all their parents from
+                        mapping.depends_on are committed.
+                        psycopg2 releases the GIL while waiting
+                        for the server, so threads are enough here.
+                        Returns {table name: seconds spent on it}
+    """
+    print(f"[Parallel load, workers: {workers}]")
+    if saver_options.get('incremental'):
+        Checkpoints.create(pg_dsl)
+    pending = list(TABLES)
+    committed = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for table_name in list(pending):
+                if committed.keys() >= set(TABLES[table_name].depends_on):
+                    pending.remove(table_name)
+                    future = pool.submit(load_table, table_name,
+                                         sqlite_path, pg_dsl,
+                                         **saver_options)
+                    running[future] = table_name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                table_name = running.pop(future)
+                # re-raise worker error, dependent tables are not started
+                committed[table_name] = future.result()
+                print(f'[{table_name} committed]')
+    return committed
+
 
-    data = DataContainer(sqlite_extractor.extract_movies(),
-                         sqlite_extractor.extract_genres(),
-                         sqlite_extractor.extract_persons(),
-                         sqlite_extractor.extract_genresfilmwork(),
-                         sqlite_extractor.extract_person_film_work(),
-                         )
+async def pipe_table(saver: PostgresSaver, extractor: SQLiteExtractor,
+                     table_name: str, queue_size: int = 4):
+    """
+        pipe_table : save one table with reading and writing
+                     overlapped. A reader task fetches and converts
+                     batches into a queue of at most `queue_size`
+                     batches while the writer task sends previous
+                     ones to Postgres; both blocking calls run in
+                     threads, so the event loop only moves batches
+    """
+    mapping = TABLES[table_name]
+    metrics = saver.metrics
+    if table_name not in saver.converters:
+        saver.converters[table_name] = build_converter(mapping)
+    convert = None if extractor.converted else saver.converters[table_name]
+    since = None
+    if saver.checkpoints:
+        since = await asyncio.to_thread(saver.checkpoints.get, table_name)
+        print(f'[{table_name} checkpoint: {since}]')
+    sizer = saver.batch_sizer()
+    batches = extractor.extract(mapping, stream=True, since=since,
+                                ordered=bool(saver.checkpoints),
+                                batch_size=sizer)
+    queue = asyncio.Queue(maxsize=queue_size)
+
+    async def read():
+        while True:
+            with metrics.stage(table_name, 'read'):
+                batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            batch = saver.validated(mapping, batch)
+            if not batch:
+                continue
+            with metrics.stage(table_name, 'convert'):
+                sql_params = convert(batch) if convert else batch
+            batch, sql_params = saver.cleaned(mapping, batch, sql_params)
+            if batch:
+                await queue.put((batch, sql_params))
+        await queue.put(None)
+
+    async def write() -> int:
+        elems_count = 0
+        while (item := await queue.get()) is not None:
+            batch, sql_params = item
+            elems_count += len(batch)
+            started = time.perf_counter()
+            await asyncio.to_thread(saver.write_batch, mapping, batch,
+                                    sql_params)
+            latency = time.perf_counter() - started
+            metrics.batch(table_name, len(batch), latency,
+                          saver.writer.bytes_sent)
+            if sizer:
+                sizer.observe(batch, latency)
+        return elems_count
+
+    reader = asyncio.create_task(read())
+    try:
+        elems_count = await write()
+    finally:
+        # stop reading if writing failed, queue.put() would wait forever
+        reader.cancel()
+    await asyncio.gather(reader, return_exceptions=True)
+    saver.sized(table_name, sizer)
+    await asyncio.to_thread(saver.save_check, elems_count, table_name)
+
+
+async def load_table_async(table_name: str, sqlite_path: str, pg_dsl: dict,
+                           queue_size: int = 4, shards: int = 1,
+                           **saver_options) -> float:
+    """Async load_table(): own connections, commit at the end.
+    Returns time spent on the table, in seconds"""
+    started = time.perf_counter()
+    # read in worker threads, one at a time
+    with closing(open_source(sqlite_path,
+                             check_same_thread=False)) as sqlite_conn, \
+            closing(await asyncio.to_thread(
+                psycopg2.connect, **pg_dsl,
+                cursor_factory=DictCursor)) as pg_conn:
+        saver_options.setdefault('pg_dsl', pg_dsl)
+        postgres_saver = PostgresSaver(pg_conn, **saver_options)
+        sqlite_extractor = make_extractor(
+            sqlite_conn, postgres_saver.slicesize, shards)
+        try:
+            await pipe_table(postgres_saver, sqlite_extractor, table_name,
+                             queue_size)
+            await asyncio.to_thread(postgres_saver.commit)
+        finally:
+            postgres_saver.close()
+    return time.perf_counter() - started
 
-    print()
-    postgres_saver.save_all_data(data)
+
+async def load_async(sqlite_path: str, pg_dsl: dict, workers: int = 3,
+                     queue_size: int = 4, **saver_options) -> dict:
+    """
+        load_async : asyncio counterpart of load_parallel(),
+                     at most `workers` tables at the same time,
+                     a table starts when its parents are committed,
+                     every table is piped by pipe_table().
+                     Returns {table name: seconds spent on it}
+    """
+    print(f"[Async load, workers: {workers}, queue: {queue_size}]")
+    if saver_options.get('incremental'):
+        Checkpoints.create(pg_dsl)
+    slots = asyncio.Semaphore(workers)
+    tasks = {}
+
+    async def run(table_name: str) -> float:
+        # parents come earlier in TABLES, their tasks already exist
+        await asyncio.gather(*(tasks[parent] for parent
+                               in TABLES[table_name].depends_on))
+        async with slots:
+            seconds = await load_table_async(table_name, sqlite_path,
+                                             pg_dsl, queue_size,
+                                             **saver_options)
+        print(f'[{table_name} committed]')
+        return seconds
+
+    for table_name in TABLES:
+        tasks[table_name] = asyncio.ensure_future(run(table_name))
+    try:
+        return dict(zip(tasks, await asyncio.gather(*tasks.values())))
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Move movies data from SQLite to Postgres')
+    parser.add_argument('--sqlite', default='db.sqlite',
+                        help='source SQLite db file')
+    parser.add_argument('--no-stream', action='store_true',
+                        help='read all tables to memory before saving')
+    parser.add_argument('--engine', choices=PostgresSaver.engines,
+                        default='copy',
+                        help='write through COPY or executemany INSERT')
+    parser.add_argument('--copy-format', choices=PostgresSaver.copy_formats,
+                        default='csv', help='data format for COPY engine')
+    parser.add_argument('--batch-size', type=int,
+                        help='rows per batch, default depends on engine')
+    parser.add_argument('--adaptive-batch', action='store_true',
+                        help='tune batch size of every table by measured '
+                             'throughput, --batch-size is the start')
+    parser.add_argument('--memory-limit', type=int, default=64,
+                        help='MiB of rows per batch for --adaptive-batch')
+    parser.add_argument('--incremental', action='store_true',
+                        help='load only rows changed since last checkpoint')
+    parser.add_argument('--reset-checkpoints', action='store_true',
+                        help='forget checkpoints, next incremental run '
+                             'reloads everything')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='write per-batch and per-table metrics as '
+                             'JSON lines to PATH, "-" for stdout')
+    parser.add_argument('--workers', type=int, default=3,
+                        help='tables loaded at the same time, 1 loads '
+                             'everything in one transaction')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='processes reading every big table by rowid '
+                             'ranges, 0 means one per CPU')
+    parser.add_argument('--clean', action='store_true',
+                        help='normalize ratings, timestamps, empty '
+                             'descriptions and creation dates and film '
+                             'types before saving')
+    parser.add_argument('--check-links', action='store_true',
+                        help='drop link rows with unknown parents or '
+                             'repeated keys before sending, to reject file')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='drop secondary indexes and foreign keys '
+                             'before the load, build them back after it')
+    parser.add_argument('--batch-commit', action='store_true',
+                        help='commit every batch, retry failed ones on a '
+                             'fresh connection, reject refused rows')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='retries of a batch after a connection error')
+    parser.add_argument('--reject-file', default='rejected_rows.jsonl',
+                        help='JSON lines file for rows refused by Postgres')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='read next batches while previous ones are '
+                             'written, with asyncio')
+    parser.add_argument('--queue-size', type=int, default=4,
+                        help='batches read ahead in --pipeline mode')
+    parser.add_argument('--staging', action='store_true',
+                        help=f'load into {STAGING} schema and swap it in '
+                             f'for content when row counts match')
+    args = parser.parse_args()
+    if args.incremental and args.no_stream:
+        parser.error('--incremental works only with streaming load')
+    if args.check_links and args.incremental:
+        parser.error('--check-links needs parents loaded in the same run, '
+                     'it does not work with --incremental')
+    if args.pipeline and args.no_stream:
+        parser.error('--pipeline works only with streaming load')
+    if args.staging and (args.incremental or args.defer_indexes):
+        parser.error('--staging is a full reload into fresh tables, it '
+                     'does not mix with --incremental or --defer-indexes')
+    return args
 
 
 if __name__ == '__main__':
-    sqlitedbfile = 'db.sqlite'
+    args = parse_args()
+    sqlitedbfile = args.sqlite
 
     if os.path.exists(sqlitedbfile):
+        if args.metrics == '-':
+            metrics_sink = sys.stdout
+        elif args.metrics:
+            metrics_sink = open(args.metrics, 'a')
+        else:
+            metrics_sink = None
+        load_metrics = LoadMetrics(metrics_sink)
+        saver_options = {'engine': args.engine,
+                         'copy_format': args.copy_format,
+                         'slicesize': args.batch_size,
+                         'incremental': args.incremental,
+                         'adaptive': args.adaptive_batch,
+                         'memory_limit': args.memory_limit * 2 ** 20,
+                         'clean': args.clean,
+                         'metrics': load_metrics,
+                         'batch_commit': args.batch_commit,
+                         'retries': args.retries,
+                         'rejects': RejectFile(args.reject_file)}
+        if args.check_links:
+            saver_options['links'] = LinkValidator(saver_options['rejects'])
+        shards = args.shards or os.cpu_count()
 
         try:
-            with conn_context(sqlitedbfile) as sqlite_conn, \
-                    psycopg2.connect(**dsl, cursor_factory=DictCursor) as pgc:
-                load_from_sqlite(sqlite_conn, pgc)
+            if args.incremental or args.reset_checkpoints:
+                Checkpoints.create(dsl)
+            if args.reset_checkpoints:
+                with closing(psycopg2.connect(**dsl)) as pgc, pgc:
+                    Checkpoints(pgc.cursor()).reset()
+            if args.staging:
+                saver_options['schema'] = STAGING
+                schema = staged_swap(dsl, sqlitedbfile,
+                                     rejects=saver_options['rejects'])
+            elif args.defer_indexes:
+                # indexes and foreign keys are restored even if load fails
+                schema = deferred_schema(dsl, list(TABLES))
+            else:
+                schema = nullcontext()
+            with schema:
+                if args.pipeline:
+                    asyncio.run(load_async(
+                        sqlitedbfile, dsl, workers=args.workers,
+                        queue_size=args.queue_size, shards=shards,
+                        **saver_options))
+                elif args.workers > 1 and not args.no_stream:
+                    load_parallel(sqlitedbfile, dsl, workers=args.workers,
+                                  shards=shards, **saver_options)
+                else:
+                    with conn_context(sqlitedbfile) as sqlite_conn, \
+                            closing(psycopg2.connect(
+                                **dsl, cursor_factory=DictCursor)) as pgc:
+                        load_from_sqlite(sqlite_conn, pgc,
+                                         stream=not args.no_stream,
+                                         shards=shards, pg_dsl=dsl,
+                                         **saver_options)
+            load_metrics.report()
+            if args.check_links:
+                saver_options['links'].report()
+            if saver_options['rejects'].count:
+                print(f"[{saver_options['rejects'].count} rows rejected, "
+                      f"see {args.reject_file}]")
+                sys.exit(1)
         except psycopg2.OperationalError:
             print('[Error] - Can\'t connect to Postgres DB')
 
@@ -0,0 +1,124 @@
+"""Loader instrumentation
+
+    LoadMetrics collects, for every table, the time spent in every
+    stage (read from SQLite, convert rows, write to Postgres,
+    checkpoint commit, final count check) and per-batch rows,
+    latency and bytes sent. Events can be streamed as JSON lines
+    while the load runs, and summary() gives the final per-table
+    numbers: rows/sec, batch latency percentiles and bytes sent.
+
+    One LoadMetrics may be shared by several threads of a
+    parallel load.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+def percentile(values: list, share: float) -> float:
+    """Nearest-rank percentile of unsorted values, share in 0..1"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(share * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class TableMetrics:
+
+    def __init__(self):
+        self.stages = {}
+        self.latencies = []
+        self.rows = 0
+        self.bytes_sent = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def summary(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return {
+            'rows': self.rows,
+            'seconds': round(elapsed, 3),
+            'rows_per_sec': round(self.rows / elapsed) if elapsed else 0,
+            'batches': len(self.latencies),
+            'batch_p50_ms': round(percentile(self.latencies, .5) * 1000, 2),
+            'batch_p95_ms': round(percentile(self.latencies, .95) * 1000, 2),
+            'batch_p99_ms': round(percentile(self.latencies, .99) * 1000, 2),
+            'bytes_sent': self.bytes_sent,
+            'stages': {name: round(seconds, 3)
+                       for name, seconds in self.stages.items()},
+        }
+
+
+class LoadMetrics:
+    """
+        LoadMetrics(sink) - sink is a text file for JSON lines
+                            events, None keeps metrics in memory only
+
+        stage(table, name)  - context manager adding elapsed time
+                              to a stage of the table
+        batch(table, ...)   - record one written batch
+        finish(table)       - close table timer, emit its summary
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def table(self, table_name: str) -> TableMetrics:
+        with self.lock:
+            if table_name not in self.tables:
+                self.tables[table_name] = TableMetrics()
+            return self.tables[table_name]
+
+    def emit(self, event: str, **data):
+        if self.sink is None:
+            return
+        line = json.dumps({'event': event, 'ts': round(time.time(), 3),
+                           **data}, default=str)
+        with self.lock:
+            self.sink.write(line + '\n')
+            self.sink.flush()
+
+    @contextmanager
+    def stage(self, table_name: str, name: str):
+        table = self.table(table_name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            table.stages[name] = table.stages.get(name, 0.0) + elapsed
+
+    def batch(self, table_name: str, rows: int, seconds: float,
+              bytes_sent: int = 0, **data):
+        table = self.table(table_name)
+        table.rows += rows
+        table.bytes_sent += bytes_sent
+        table.latencies.append(seconds)
+        self.emit('batch', table=table_name, rows=rows,
+                  seconds=round(seconds, 6), bytes=bytes_sent, **data)
+
+    def finish(self, table_name: str, **data):
+        table = self.table(table_name)
+        table.finished = time.perf_counter()
+        self.emit('table', table=table_name, **table.summary(), **data)
+
+    def summary(self) -> dict:
+        return {name: table.summary() for name, table in self.tables.items()}
+
+    def report(self):
+        """Print human readable summary and emit it as JSON line"""
+        summary = self.summary()
+        for name, table in summary.items():
+            stages = ', '.join(f'{stage} {seconds}s'
+                               for stage, seconds in table['stages'].items())
+            print(f"{name}: {table['rows']} rows in {table['seconds']}s, "
+                  f"{table['rows_per_sec']} rows/s, batch p50/p95/p99 "
+                  f"{table['batch_p50_ms']}/{table['batch_p95_ms']}/"
+                  f"{table['batch_p99_ms']} ms, "
+                  f"{table['bytes_sent'] / 2 ** 20:.1f} MiB sent "
+                  f"({stages})")
+        self.emit('summary', tables=summary)
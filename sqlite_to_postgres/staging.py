@@ -0,0 +1,254 @@
+"""Staging-schema load with atomic swap
+
+    staged_swap() lets the loader fill a copy of the content tables
+    in the content_staging schema while movies_admin keeps reading
+    the live ones:
+    - staging tables are created UNLOGGED, with primary keys only,
+    - after the load they are made LOGGED, get the unique constraints,
+      indexes, foreign keys and triggers of content (built in parallel)
+      and their row counts are checked against the SQLite source, less
+      rows the loader rejected or dropped (its RejectFile),
+    - then one short transaction gives them the owner, privileges and
+      comment of the live tables (CREATE TABLE ... LIKE copies none of
+      them), moves the live tables away and the staging ones in their
+      place, the old tables are dropped after.
+
+    The loader role must own the content tables or be a member of
+    their owner role (or a superuser), as moving them requires.
+
+    On a load error staging is dropped and content stays untouched,
+    on a count mismatch staging is kept for inspection.
+"""
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+
+import psycopg2
+
+from deferred_schema import capture
+from table_mapping import MAPPINGS, TABLES
+
+STAGING = 'content_staging'
+RETIRED = 'content_retired'
+
+CONSTRAINTS_SQL = """
+SELECT tbl.relname, con.contype, con.conname, pg_get_constraintdef(con.oid)
+FROM pg_constraint con
+JOIN pg_class tbl ON tbl.oid = con.conrelid
+JOIN pg_namespace ns ON ns.oid = tbl.relnamespace
+WHERE ns.nspname = 'content' AND tbl.relname = ANY(%s)
+  AND con.contype IN ('p', 'u');
+"""
+
+TRIGGERS_SQL = """
+SELECT tbl.relname, pg_get_triggerdef(tg.oid)
+FROM pg_trigger tg
+JOIN pg_class tbl ON tbl.oid = tg.tgrelid
+JOIN pg_namespace ns ON ns.oid = tbl.relnamespace
+WHERE ns.nspname = 'content' AND tbl.relname = ANY(%s)
+  AND NOT tg.tgisinternal;
+"""
+
+OWNERS_SQL = """
+SELECT tbl.relname, quote_ident(pg_get_userbyid(tbl.relowner)),
+       obj_description(tbl.oid, 'pg_class')
+FROM pg_class tbl
+JOIN pg_namespace ns ON ns.oid = tbl.relnamespace
+WHERE ns.nspname = 'content' AND tbl.relname = ANY(%s);
+"""
+
+# NULL relacl stands for the default privileges of the owner
+PRIVILEGES_SQL = """
+SELECT tbl.relname,
+       CASE WHEN acl.grantee = 0 THEN 'PUBLIC'
+            ELSE quote_ident(pg_get_userbyid(acl.grantee)) END,
+       acl.privilege_type, acl.is_grantable
+FROM pg_class tbl
+JOIN pg_namespace ns ON ns.oid = tbl.relnamespace
+CROSS JOIN LATERAL aclexplode(
+    coalesce(tbl.relacl, acldefault('r', tbl.relowner))) AS acl
+WHERE ns.nspname = %s AND tbl.relname = ANY(%s);
+"""
+
+
+def content_ddl(curs) -> dict:
+    """{table: {'primary': [...], 'unique': [...], 'indexes': [...],
+    'fkeys': [...], 'triggers': [...]}} statements rebuilding content
+    objects in STAGING"""
+    # with an empty search_path every name in definitions is qualified
+    curs.execute("SET LOCAL search_path = pg_catalog;")
+    ddl = {table_name: {'primary': [], 'unique': [], 'indexes': [],
+                        'fkeys': [], 'triggers': []}
+           for table_name in TABLES}
+    curs.execute(CONSTRAINTS_SQL, (list(TABLES),))
+    for table_name, contype, name, definition in curs.fetchall():
+        ddl[table_name]['primary' if contype == 'p' else 'unique'].append(
+            f'ALTER TABLE {STAGING}.{table_name} ADD CONSTRAINT "{name}" '
+            f'{definition};')
+    for kind, table_name, name, definition in capture(curs, list(TABLES)):
+        definition = definition.replace(' content.', f' {STAGING}.')
+        if kind == 'index':
+            ddl[table_name]['indexes'].append(definition + ';')
+        else:
+            ddl[table_name]['fkeys'].append(
+                f'ALTER TABLE {STAGING}.{table_name} ADD CONSTRAINT '
+                f'"{name}" {definition};')
+    curs.execute(TRIGGERS_SQL, (list(TABLES),))
+    for table_name, definition in curs.fetchall():
+        # trigger functions stay where they are
+        ddl[table_name]['triggers'].append(definition.replace(
+            f' ON content.{table_name} ',
+            f' ON {STAGING}.{table_name} ', 1) + ';')
+    return ddl
+
+
+def create_staging(pg_dsl: dict) -> dict:
+    """Empty UNLOGGED copies of content tables, with primary keys
+    only (the loader upserts on them). Returns content_ddl()"""
+    with closing(psycopg2.connect(**pg_dsl)) as conn, conn:
+        curs = conn.cursor()
+        curs.execute(f"DROP SCHEMA IF EXISTS {STAGING} CASCADE;")
+        curs.execute(f"CREATE SCHEMA {STAGING};")
+        ddl = content_ddl(curs)
+        for table_name in TABLES:
+            curs.execute(
+                f"CREATE UNLOGGED TABLE {STAGING}.{table_name} "
+                f"(LIKE content.{table_name} "
+                f"INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+                f"INCLUDING COMMENTS);")
+            for statement in ddl[table_name]['primary']:
+                curs.execute(statement)
+    print(f'[staging schema {STAGING} created]')
+    return ddl
+
+
+def drop_staging(pg_dsl: dict):
+    with closing(psycopg2.connect(**pg_dsl)) as conn, conn:
+        conn.cursor().execute(f"DROP SCHEMA IF EXISTS {STAGING} CASCADE;")
+
+
+def _run(pg_dsl: dict, statements: list, maintenance_work_mem: str):
+    with closing(psycopg2.connect(**pg_dsl)) as conn, conn:
+        curs = conn.cursor()
+        curs.execute("SET maintenance_work_mem = %s;",
+                     (maintenance_work_mem,))
+        for statement in statements:
+            curs.execute(statement)
+
+
+def build_staging(pg_dsl: dict, ddl: dict, workers: int = 4,
+                  maintenance_work_mem: str = '256MB'):
+    """Make staging tables LOGGED, then build their unique
+    constraints and indexes, one table per connection, and
+    foreign keys and triggers last, when all referenced tables
+    are ready (triggers after the load, it must not fire them)"""
+    # a logged table may not reference an unlogged one: parents first
+    _run(pg_dsl, [f"ALTER TABLE {STAGING}.{mapping.target} SET LOGGED;"
+                  for mapping in MAPPINGS], maintenance_work_mem)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run, pg_dsl,
+                               objects['unique'] + objects['indexes'],
+                               maintenance_work_mem)
+                   for objects in ddl.values()]
+        for future in futures:
+            future.result()
+    _run(pg_dsl, [statement for objects in ddl.values()
+                  for statement in objects['fkeys'] + objects['triggers']]
+         + [f"ANALYZE {STAGING}.{table_name};" for table_name in TABLES],
+         maintenance_work_mem)
+    print('[staging indexes and foreign keys built]')
+
+
+def count_mismatches(sqlite_path: str, pg_dsl: dict,
+                     skipped: dict = None) -> dict:
+    """{table: (expected rows, staging rows)} of tables which differ,
+    expected are source rows less `skipped` ones ({table: rows})"""
+    skipped = skipped or {}
+    mismatches = {}
+    with closing(sqlite3.connect(sqlite_path)) as sqlite_conn, \
+            closing(psycopg2.connect(**pg_dsl)) as conn:
+        curs = conn.cursor()
+        for mapping in MAPPINGS:
+            source = sqlite_conn.execute(
+                f"SELECT count(*) FROM {mapping.source};").fetchone()[0]
+            expected = source - skipped.get(mapping.target, 0)
+            curs.execute(f"SELECT count(*) FROM {STAGING}.{mapping.target};")
+            target = curs.fetchone()[0]
+            if expected != target:
+                mismatches[mapping.target] = (expected, target)
+    return mismatches
+
+
+def copy_access(curs):
+    """Owner, privileges and comment of every content table on its
+    staging copy"""
+    tables = list(TABLES)
+    curs.execute(OWNERS_SQL, (tables,))
+    for table_name, owner, comment in curs.fetchall():
+        # an owner must be allowed to create in the schema of the table
+        curs.execute(f"GRANT CREATE ON SCHEMA {STAGING} TO {owner};")
+        curs.execute(f"ALTER TABLE {STAGING}.{table_name} OWNER TO {owner};")
+        curs.execute(f"COMMENT ON TABLE {STAGING}.{table_name} IS %s;",
+                     (comment,))
+    # staging tables have the privileges of their creator (and its
+    # default privileges), replaced with the ones of content
+    curs.execute(PRIVILEGES_SQL, (STAGING, tables))
+    for table_name, grantee, privilege, _ in curs.fetchall():
+        curs.execute(f"REVOKE {privilege} ON {STAGING}.{table_name} "
+                     f"FROM {grantee};")
+    curs.execute(PRIVILEGES_SQL, ('content', tables))
+    for table_name, grantee, privilege, grantable in curs.fetchall():
+        curs.execute(f"GRANT {privilege} ON {STAGING}.{table_name} "
+                     f"TO {grantee}"
+                     f"{' WITH GRANT OPTION' if grantable else ''};")
+
+
+def swap(pg_dsl: dict, lock_timeout: str = '10s'):
+    """Move staging tables to content in one transaction,
+    readers wait only for the catalog changes, not for data"""
+    with closing(psycopg2.connect(**pg_dsl)) as conn:
+        with conn:
+            curs = conn.cursor()
+            curs.execute("SET LOCAL lock_timeout = %s;", (lock_timeout,))
+            copy_access(curs)
+            curs.execute(f"DROP SCHEMA IF EXISTS {RETIRED} CASCADE;")
+            curs.execute(f"CREATE SCHEMA {RETIRED};")
+            # all live tables out first, so index names do not clash
+            for table_name in TABLES:
+                curs.execute(f"ALTER TABLE content.{table_name} "
+                             f"SET SCHEMA {RETIRED};")
+            for table_name in TABLES:
+                curs.execute(f"ALTER TABLE {STAGING}.{table_name} "
+                             f"SET SCHEMA content;")
+            curs.execute(f"DROP SCHEMA {STAGING};")
+        with conn:
+            conn.cursor().execute(f"DROP SCHEMA {RETIRED} CASCADE;")
+    print('[staging swapped in for content]')
+
+
+@contextmanager
+def staged_swap(pg_dsl: dict, sqlite_path: str, workers: int = 4,
+                rejects=None):
+    """
+        staged_swap : create staging tables, run the load inside
+                      the block (savers must get schema=STAGING),
+                      then build, verify and swap them in
+        rejects     : load_data.RejectFile shared by the savers,
+                      rows written to it are not expected in staging
+    """
+    ddl = create_staging(pg_dsl)
+    try:
+        yield
+    except BaseException:
+        drop_staging(pg_dsl)
+        raise
+    build_staging(pg_dsl, ddl, workers)
+    mismatches = count_mismatches(
+        sqlite_path, pg_dsl, rejects.tables if rejects else None)
+    if mismatches:
+        for table_name, (expected, target) in mismatches.items():
+            print(f'[{table_name}] ERROR, expected rows: {expected}, '
+                  f'staging rows: {target}')
+        print(f'[content not replaced, {STAGING} kept for inspection]')
+        return
+    swap(pg_dsl)
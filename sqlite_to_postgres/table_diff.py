@@ -0,0 +1,111 @@
+"""Full row-by-row diff of SQLite source and Postgres target tables
+
+    Both sides are read in primary key order and merged like a sorted
+    merge-join, so memory does not depend on table size:
+    - SQLite with keyset pagination (WHERE id > last id LIMIT n),
+    - Postgres with a named (server-side) cursor.
+    Column names are taken from table_mapping (created_at -> created,
+    ...) and values are normalized the same way as in consistency.py
+    (timestamps cut to seconds, floats to 3 decimals, ...).
+
+    Every difference is printed as a JSON line:
+        {"table": ..., "id": ..., "status": "missing" | "extra" |
+         "changed", "columns": {column: [source, target]}}
+    followed by a per-table summary.
+
+    usage (from sqlite_to_postgres/):
+        python table_diff.py --sqlite db.sqlite --table person
+"""
+import argparse
+import json
+import sqlite3
+import sys
+from contextlib import closing
+
+import psycopg2
+
+from consistency import dsl, pg_value_sql, source_id_sql, sqlite_value_sql
+from table_mapping import TABLES, TableMapping
+
+
+def sqlite_rows(conn: sqlite3.Connection, mapping: TableMapping,
+                page_size: int = 5000):
+    """Yield normalized source rows in id order, page by page, each
+    page is an index range seek on the id primary key"""
+    values = ', '.join(map(sqlite_value_sql, mapping.columns))
+    id_sql = source_id_sql(conn, mapping)
+    last_id = ''
+    while True:
+        page = conn.execute(
+            f"SELECT {values} FROM {mapping.source} WHERE {id_sql} > ? "
+            f"ORDER BY {id_sql} LIMIT ?;", (last_id, page_size)).fetchall()
+        if not page:
+            return
+        yield from page
+        last_id = page[-1][mapping.position('id')]
+
+
+def pg_rows(conn, mapping: TableMapping, page_size: int = 5000):
+    """Yield normalized target rows in id order from a named cursor"""
+    values = ', '.join(map(pg_value_sql, mapping.columns))
+    with conn.cursor(name=f'diff_{mapping.target}') as curs:
+        curs.itersize = page_size
+        curs.execute(f"SELECT {values} FROM content.{mapping.target} "
+                     f"ORDER BY id;")
+        for row in curs:
+            yield tuple(row)
+
+
+def merge_diff(mapping: TableMapping, source, target):
+    """Merge two id-ordered row streams, yield differences"""
+    key = mapping.position('id')
+    names = mapping.target_columns
+    src = next(source, None)
+    tgt = next(target, None)
+    while src is not None or tgt is not None:
+        if tgt is None or (src is not None and src[key] < tgt[key]):
+            yield {'id': src[key], 'status': 'missing'}
+            src = next(source, None)
+        elif src is None or tgt[key] < src[key]:
+            yield {'id': tgt[key], 'status': 'extra'}
+            tgt = next(target, None)
+        else:
+            if src != tgt:
+                yield {'id': src[key], 'status': 'changed',
+                       'columns': {name: [old, new] for name, old, new
+                                   in zip(names, src, tgt) if old != new}}
+            src = next(source, None)
+            tgt = next(target, None)
+
+
+def diff_table(sqlite_conn, pg_conn, mapping: TableMapping,
+               out=sys.stdout, page_size: int = 5000) -> dict:
+    """Write differences of one table to `out`, return their counts"""
+    counts = {'missing': 0, 'extra': 0, 'changed': 0}
+    for diff in merge_diff(mapping,
+                           sqlite_rows(sqlite_conn, mapping, page_size),
+                           pg_rows(pg_conn, mapping, page_size)):
+        counts[diff['status']] += 1
+        out.write(json.dumps({'table': mapping.target, **diff}) + '\n')
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Diff SQLite source and Postgres target row by row')
+    parser.add_argument('--sqlite', default='db.sqlite',
+                        help='source SQLite db file')
+    parser.add_argument('--table', action='append', choices=TABLES,
+                        help='table to diff, default: all of them')
+    parser.add_argument('--page-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    differs = False
+    with closing(sqlite3.connect(args.sqlite)) as sqlite_conn, \
+            closing(psycopg2.connect(**dsl)) as pg_conn:
+        for table_name in args.table or TABLES:
+            counts = diff_table(sqlite_conn, pg_conn, TABLES[table_name],
+                                page_size=args.page_size)
+            differs = differs or any(counts.values())
+            print(json.dumps({'table': table_name, 'summary': counts}))
+    sys.exit(1 if differs else 0)
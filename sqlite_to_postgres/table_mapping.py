@@ -0,0 +1,214 @@
+"""Declarative SQLite -> Postgres table mapping
+
+    Every table moved by load_data.py is described by one TableMapping:
+    source columns, target columns, optional per-column transform,
+    cleaning function and allowed values, and conflict key. The loader
+    builds one row converter and one writer per table from this spec,
+    so adding a table or a column is a change of MAPPINGS only.
+"""
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from cleaning import (FILM_TYPES, INTEGER_TYPES, clean_rating,
+                      clean_rating_integer, clean_timestamp, fill_null,
+                      normalize_choice)
+
+KINDS = ('text', 'uuid', 'timestamp', 'date', 'float')
+
+
+@dataclass(frozen=True)
+class Column:
+    source: str
+    target: str
+    # applied to every value read from SQLite, None means "as is"
+    transform: Optional[Callable] = None
+    # value type, one of KINDS, used to compare and encode values
+    kind: str = 'text'
+    # cleaning stage (load_data.py --clean): function taking all values
+    # of the column in a batch, and values allowed after it
+    clean: Optional[Callable] = None
+    choices: tuple = ()
+    # used instead of `clean` when the target column is an integer
+    clean_integer: Optional[Callable] = None
+    # source column whose cleaned value replaces NULL of this one
+    fallback: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class TableMapping:
+    source: str
+    target: str
+    columns: tuple
+    conflict_key: tuple = ('id',)
+    # source column used as high-watermark by the incremental mode
+    watermark: str = 'updated_at'
+    # tables which must be committed before this one (FK parents)
+    depends_on: tuple = ()
+    # ((source column, parent table), ...) foreign keys to check
+    references: tuple = ()
+    # source columns unique together, as unique_together of the model
+    unique: tuple = ()
+
+    @property
+    def source_columns(self) -> tuple:
+        return tuple(column.source for column in self.columns)
+
+    @property
+    def target_columns(self) -> tuple:
+        return tuple(column.target for column in self.columns)
+
+    def position(self, source_name: str) -> int:
+        """Index of a source column in rows read for this table"""
+        return self.source_columns.index(source_name)
+
+
+def build_converter(mapping: TableMapping):
+    """
+        Batch converter for the mapping, built once.
+        Returns None when no column has a transform, rows read from
+        SQLite are already ordered as target columns and are passed
+        to the writer untouched. Otherwise returns a function which
+        turns the batch to columns, maps every transformed column
+        through its transform at once and turns columns back to
+        rows, so there is no per-column loop for every row.
+    """
+    transforms = [(pos, column.transform)
+                  for pos, column in enumerate(mapping.columns)
+                  if column.transform]
+    if not transforms:
+        return None
+
+    def convert(batch: list) -> list:
+        if not batch:
+            return []
+        columns = list(zip(*batch))
+        for pos, transform in transforms:
+            columns[pos] = map(transform, columns[pos])
+        return list(zip(*columns))
+
+    return convert
+
+
+def build_cleaner(mapping: TableMapping, column_types: dict = None):
+    """
+        Batch cleaner for the mapping, None when no column has
+        clean or choices. The cleaner takes converted rows, turns
+        them to columns, runs every column function once over its
+        whole column, checks choices and turns columns back to
+        rows. Returns (rows, {row index: reason}) of rows whose
+        values are not allowed, callers drop those rows.
+        `column_types` ({target column: Postgres type}) selects
+        clean_integer of columns stored as integers. NULLs of
+        columns with a fallback are filled after all functions ran.
+    """
+    column_types = column_types or {}
+    steps = [(pos, column.clean_integer
+              if column.clean_integer
+              and column_types.get(column.target) in INTEGER_TYPES
+              else column.clean)
+             for pos, column in enumerate(mapping.columns) if column.clean]
+    fallbacks = [(pos, mapping.position(column.fallback))
+                 for pos, column in enumerate(mapping.columns)
+                 if column.fallback]
+    checks = [(pos, frozenset(column.choices),
+               f'invalid {column.target}, allowed: {column.choices}')
+              for pos, column in enumerate(mapping.columns)
+              if column.choices]
+    if not steps and not fallbacks and not checks:
+        return None
+
+    def clean(batch: list) -> tuple:
+        columns = list(zip(*batch))
+        for pos, function in steps:
+            columns[pos] = function(columns[pos])
+        for pos, other in fallbacks:
+            columns[pos] = [fallback if value is None else value
+                            for value, fallback
+                            in zip(columns[pos], columns[other])]
+        invalid = {}
+        for pos, allowed, reason in checks:
+            for index, value in enumerate(columns[pos]):
+                if value not in allowed:
+                    invalid.setdefault(index, reason)
+        return list(zip(*columns)), invalid
+
+    return clean
+
+
+MAPPINGS = (
+    TableMapping(
+        source='film_work', target='film_work',
+        columns=(
+            Column('id', 'id', kind='uuid'),
+            Column('title', 'title'),
+            Column('description', 'description', clean=fill_null('')),
+            # NOT NULL in the Django model, the date the row was added
+            Column('creation_date', 'creation_date', kind='date',
+                   fallback='created_at'),
+            Column('rating', 'rating', kind='float', clean=clean_rating,
+                   clean_integer=clean_rating_integer),
+            Column('type', 'type', clean=normalize_choice,
+                   choices=FILM_TYPES),
+            Column('created_at', 'created', kind='timestamp',
+                   clean=clean_timestamp),
+            Column('updated_at', 'modified', kind='timestamp',
+                   clean=clean_timestamp),
+        ),
+    ),
+    TableMapping(
+        source='person', target='person',
+        columns=(
+            Column('id', 'id', kind='uuid'),
+            Column('full_name', 'full_name'),
+            Column('created_at', 'created', kind='timestamp',
+                   clean=clean_timestamp),
+            Column('updated_at', 'modified', kind='timestamp',
+                   clean=clean_timestamp),
+        ),
+    ),
+    TableMapping(
+        source='genre', target='genre',
+        columns=(
+            Column('id', 'id', kind='uuid'),
+            Column('name', 'name'),
+            Column('description', 'description', clean=fill_null('')),
+            Column('created_at', 'created', kind='timestamp',
+                   clean=clean_timestamp),
+            Column('updated_at', 'modified', kind='timestamp',
+                   clean=clean_timestamp),
+        ),
+    ),
+    TableMapping(
+        source='genre_film_work', target='genre_film_work',
+        columns=(
+            Column('id', 'id', kind='uuid'),
+            Column('film_work_id', 'film_work_id', kind='uuid'),
+            Column('genre_id', 'genre_id', kind='uuid'),
+            Column('created_at', 'created', kind='timestamp',
+                   clean=clean_timestamp),
+        ),
+        watermark='created_at',
+        depends_on=('film_work', 'genre'),
+        references=(('film_work_id', 'film_work'), ('genre_id', 'genre')),
+        unique=('genre_id', 'film_work_id'),
+    ),
+    TableMapping(
+        source='person_film_work', target='person_film_work',
+        columns=(
+            Column('id', 'id', kind='uuid'),
+            Column('film_work_id', 'film_work_id', kind='uuid'),
+            Column('person_id', 'person_id', kind='uuid'),
+            Column('role', 'role'),
+            Column('created_at', 'created', kind='timestamp',
+                   clean=clean_timestamp),
+        ),
+        watermark='created_at',
+        depends_on=('film_work', 'person'),
+        references=(('film_work_id', 'film_work'),
+                    ('person_id', 'person')),
+        unique=('film_work_id', 'person_id'),
+    ),
+)
+
+# target table name: mapping, in an order safe for sequential loading
+TABLES = {mapping.target: mapping for mapping in MAPPINGS}
@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..'))
+from table_mapping import (TABLES, Column, TableMapping,  # noqa: E402
+                           build_converter)
+
+
+mapping = TableMapping(
+    source='genre', target='genre',
+    columns=(
+        Column('id', 'id', kind='uuid', transform=str.lower),
+        Column('name', 'name'),
+        Column('description', 'description',
+               transform=lambda value: value or ''),
+    ),
+)
+
+
+class TestConverter(unittest.TestCase):
+
+    def test1_no_transform(self):
+        self.assertIsNone(build_converter(TABLES['genre']))
+
+    def test2_transformed_columns(self):
+        convert = build_converter(mapping)
+        batch = [('AB-CD', 'Drama', None), ('ef', 'Comedy', 'funny')]
+        self.assertEqual(convert(batch), [('ab-cd', 'Drama', ''),
+                                          ('ef', 'Comedy', 'funny')])
+
+    def test3_empty_batch(self):
+        self.assertEqual(build_converter(mapping)([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()